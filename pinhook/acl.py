@@ -0,0 +1,154 @@
+import os
+import re
+
+from .log import logger
+
+
+def _is_mask(entry):
+    return any(c in entry for c in '*?!@')
+
+
+def _mask_pattern(entry):
+    # nick!user@host wildcards, a mask without ! or @ only matches the nick
+    pattern = ''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in entry)
+    if '!' in entry or '@' in entry:
+        return pattern
+    return pattern + '(?:!.*)?'
+
+
+class MaskSet:
+    # plain nicks and ids are kept in a set, wildcard hostmasks are compiled
+    # into one pattern the first time they are needed. Lookups ignore case
+    def __init__(self, entries=()):
+        self.entries = {}
+        self.masks = {}
+        self._pattern = None
+        for entry in entries:
+            self.add(entry)
+
+    def __contains__(self, entry):
+        return entry is not None and str(entry).lower() in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries.values()) + list(self.masks.values()))
+
+    def __len__(self):
+        return len(self.entries) + len(self.masks)
+
+    def __bool__(self):
+        return bool(self.entries or self.masks)
+
+    def __repr__(self):
+        return 'MaskSet({!r})'.format(list(self))
+
+    def add(self, entry):
+        key = entry.lower()
+        if _is_mask(key):
+            if key in self.masks:
+                return False
+            self.masks[key] = entry
+            self._pattern = None
+        else:
+            if key in self.entries:
+                return False
+            self.entries[key] = entry
+        return True
+
+    def discard(self, entry):
+        key = entry.lower()
+        if self.entries.pop(key, None) is not None:
+            return True
+        if self.masks.pop(key, None) is not None:
+            self._pattern = None
+            return True
+        return False
+
+    def match(self, nick, mask=None, user_id=None):
+        if nick and nick.lower() in self.entries:
+            return True
+        if user_id and user_id.lower() in self.entries:
+            return True
+        if not self.masks:
+            return False
+        if self._pattern is None:
+            self._pattern = re.compile('|'.join('(?:{})'.format(_mask_pattern(m)) for m in self.masks))
+        return bool(self._pattern.fullmatch(str(mask or nick).lower()))
+
+
+class ACL:
+    # ops and bans for one bot. Changes made while running are appended to
+    # `path` and replayed over the entries from the config on startup
+    lists = ('ops', 'banned')
+
+    def __init__(self, ops=(), banned=(), path=None):
+        self.ops = MaskSet(ops)
+        self.banned = MaskSet(banned)
+        self.config = {'ops': list(ops), 'banned': list(banned)}
+        self.path = path
+        self._file = None
+        self._records = 0
+        if path:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                head, _, entry = line.rstrip('\n').partition(' ')
+                action, name = head[:1], head[1:]
+                if name not in self.lists or not entry:
+                    continue
+                if action == '+':
+                    getattr(self, name).add(entry)
+                elif action == '-':
+                    getattr(self, name).discard(entry)
+                self._records += 1
+        # rewrite the file once removals make up most of it
+        if self._records > 2 * (len(self.ops) + len(self.banned)) + 100:
+            self.compact()
+
+    def _write(self, line):
+        if not self.path:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(line + '\n')
+        self._file.flush()
+        self._records += 1
+
+    def add(self, name, entry):
+        if getattr(self, name).add(entry):
+            self._write('+{} {}'.format(name, entry))
+            return True
+        return False
+
+    def discard(self, name, entry):
+        if getattr(self, name).discard(entry):
+            self._write('-{} {}'.format(name, entry))
+            return True
+        return False
+
+    def compact(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for name in self.lists:
+                entries = getattr(self, name)
+                config = MaskSet(self.config[name])
+                for entry in entries:
+                    if entry not in config and entry.lower() not in config.masks:
+                        f.write('+{} {}\n'.format(name, entry))
+                for entry in config:
+                    if entry not in entries and entry.lower() not in entries.masks:
+                        f.write('-{} {}\n'.format(name, entry))
+        if self._file:
+            self._file.close()
+            self._file = None
+        os.replace(tmp, self.path)
+        self._records = len(self.ops) + len(self.banned)
+        logger.debug('compacted acl file %s', self.path)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
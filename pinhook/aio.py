@@ -0,0 +1,123 @@
+import asyncio
+import datetime
+import time
+
+from . import metrics
+from .bot import Bot, TwitchBot
+
+import irc.client
+import irc.client_aio
+import irc.connection
+
+
+def _seconds(value):
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return value
+
+
+class LoopScheduler:
+    # implements irc.schedule.IScheduler on top of an asyncio loop so the
+    # send queue, worker pool and reconnect strategy work unchanged
+    def __init__(self, loop):
+        self.loop = loop
+
+    def execute_after(self, delay, func):
+        return self.loop.call_later(_seconds(delay), func)
+
+    def execute_at(self, when, func):
+        if isinstance(when, datetime.datetime):
+            when = when.timestamp()
+        return self.loop.call_later(max(0, when - time.time()), func)
+
+    def execute_every(self, period, func):
+        period = _seconds(period)
+        def run():
+            self.loop.call_later(period, run)
+            func()
+        return self.loop.call_later(period, run)
+
+    def run_pending(self):
+        pass
+
+
+class AioReactor(irc.client_aio.AioReactor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = LoopScheduler(self.loop)
+
+
+class AsyncBot(Bot):
+    def __init__(self, *args, loop=None, **kwargs):
+        self.loop = loop
+        self._tasks = set()
+        super().__init__(*args, **kwargs)
+        # asyncio has its own streams, the websocket transports aren't
+        # available here
+        if self.transport not in ('tcp', 'tls'):
+            raise ValueError('AsyncBot only supports the tcp and tls transports')
+
+    def reactor_class(self):
+        return AioReactor(loop=self.loop)
+
+    def connect(self, *args, **kwargs):
+        kwargs['connect_factory'] = irc.connection.AioFactory(ssl=self.connect_factory.context or False)
+        task = self.reactor.loop.create_task(self.connection.connect(*args, **kwargs))
+        task.add_done_callback(self._on_connect_done)
+
+    def _on_connect_done(self, task):
+        if task.cancelled():
+            return
+        if task.exception():
+            self.logger.error('could not connect: %s', task.exception())
+            self.connection._handle_event(irc.client.Event('disconnect', self.connection.server, '', ['']))
+
+    async def run(self):
+        # for use from an already running event loop, in place of start()
+        self._connect()
+        await self.reactor.loop.create_future()
+
+    def run_plugin(self, p, message, chan):
+        p = p.resolve()
+        if not p:
+            return None
+        key = None
+        if p.cache is not None:
+            key = p.cache.key(message)
+            output = p.cache.get(key)
+            if output:
+                return output
+        if len(self._tasks) >= self.worker_queue_size:
+            self.logger.warning('plugin queue full, dropping call to %s', p)
+            return None
+        task = self.reactor.loop.create_task(self._run_plugin(p, message, chan, key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_plugin(self, p, message, chan, key=None):
+        timeout = p.timeout or self.worker_timeout
+        start = time.perf_counter() if metrics.enabled else None
+        error = True
+        try:
+            if asyncio.iscoroutinefunction(p.run):
+                output = await asyncio.wait_for(p.run(message), timeout)
+            else:
+                output = await asyncio.wait_for(self.workers.run_in_executor(self.reactor.loop, p, message), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning('plugin %s timed out, discarding result', p)
+        except Exception:
+            self.logger.exception('issue with plugin %s', p)
+        else:
+            error = False
+            if output and p.cache is not None:
+                p.cache.put(key, output)
+            if output:
+                self.logger.debug('sending deferred output: %s', output.msg)
+                self.process_output(self.connection, chan, output)
+        finally:
+            if start is not None:
+                metrics.record(p.kind, str(p), time.perf_counter() - start, error=error)
+
+
+class AsyncTwitchBot(AsyncBot, TwitchBot):
+    pass
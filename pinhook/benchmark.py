@@ -0,0 +1,293 @@
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from . import plugin
+from .bot import Bot, TwitchBot
+from .fakeserver import FakeServer
+from .metrics import Histogram
+
+WORDS = ('hello', 'world', 'python', 'irc', 'bot', 'plugin', 'weather', 'coffee',
+         'link', 'music', 'game', 'help', 'please', 'thanks', 'today', 'tomorrow')
+
+
+class FakeSocket:
+    # stands in for the server socket, output is counted and thrown away
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+
+    def send(self, data):
+        self.lines += 1
+        self.bytes += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def synthetic_stream(channels=10, nicks=500, messages=10000, command_ratio=.1, commands=('!ping',), botnick='bot', seed=0):
+    # returns the lines needed to get the bot into its channels, and the
+    # chatter to replay once it is there
+    rng = random.Random(seed)
+    chans = ['#chan{}'.format(i) for i in range(channels)]
+    users = ['user{}'.format(i) for i in range(nicks)]
+    setup = [':irc.test 001 {} :Welcome'.format(botnick)]
+    for chan in chans:
+        setup.append(':{0}!{0}@bench JOIN {1}'.format(botnick, chan))
+        for i in range(0, len(users), 50):
+            setup.append(':irc.test 353 {} = {} :{}'.format(botnick, chan, ' '.join(users[i:i + 50])))
+        setup.append(':irc.test 366 {} {} :End of /NAMES list.'.format(botnick, chan))
+    lines = []
+    for _ in range(messages):
+        nick = rng.choice(users)
+        if commands and rng.random() < command_ratio:
+            text = '{} {}'.format(rng.choice(commands), rng.choice(WORDS))
+        else:
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        lines.append(':{0}!{0}@bench PRIVMSG {1} :{2}'.format(nick, rng.choice(chans), text))
+    return setup, lines
+
+
+def read_stream(path):
+    # recorded raw lines as sent by a server, blank lines are skipped
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return [line.rstrip('\r\n') for line in f if line.strip()]
+
+
+def _reply(msg):
+    return plugin.message('{}: {}'.format(msg.nick, msg.arg or 'pong'))
+
+def _listen(msg):
+    return None
+
+def register_plugins(commands=10, listeners=50):
+    # synthetic workload: commands that answer, and a mix of keyword, regex
+    # and catch-all listeners that only look at the text
+    plugin.clear_plugins()
+    names = ['!ping'] + ['!bench{}'.format(i) for i in range(1, commands)]
+    for name in names[:commands]:
+        plugin.command(name, 'benchmark command')(_reply)
+    for i in range(listeners):
+        if i % 10 == 0:
+            plugin.listener('bench_all{}'.format(i))(_listen)
+        elif i % 3 == 0:
+            plugin.listener('bench_re{}'.format(i), regex=r'\b{}\w*'.format(WORDS[i % len(WORDS)]))(_listen)
+        else:
+            plugin.listener('bench_kw{}'.format(i), keywords=[WORDS[i % len(WORDS)]])(_listen)
+    return names[:commands]
+
+
+class _Stage:
+    def __init__(self, name, func, histograms):
+        self.histogram = histograms.setdefault(name, Histogram())
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.histogram.record(time.perf_counter() - start)
+
+
+def make_bot(plugin_dir=None, botnick='bot', **kwargs):
+    kwargs.setdefault('log_level', 'error')
+    kwargs.setdefault('log_file', os.devnull)
+    kwargs.setdefault('send_rate', 0)
+    bot = Bot([], botnick, 'irc.test', plugin_dir=plugin_dir or 'plugins', load_plugins=bool(plugin_dir), **kwargs)
+    bot.connection.connect('irc.test', 6667, botnick, connect_factory=lambda address: FakeSocket())
+    return bot
+
+
+def run(bot, lines, setup=(), trace_allocations=False):
+    c = bot.connection
+    for line in setup:
+        c._process_line(line)
+    histograms = {}
+    bot.process_event = _Stage('process_event', bot.process_event, histograms)
+    bot.call_plugins = _Stage('call_plugins', bot.call_plugins, histograms)
+    bot.process_output = _Stage('process_output', bot.process_output, histograms)
+    process_line = _Stage('process_line', c._process_line, histograms)
+    sent_lines, sent_bytes = c.socket.lines, c.socket.bytes
+    if trace_allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        for line in lines:
+            process_line(line)
+        elapsed = time.perf_counter() - start
+        if trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if trace_allocations:
+            tracemalloc.stop()
+        del bot.process_event, bot.call_plugins, bot.process_output
+    result = {
+        'messages': len(lines),
+        'seconds': elapsed,
+        'messages_per_second': len(lines) / elapsed if elapsed else 0.0,
+        'lines_sent': c.socket.lines - sent_lines,
+        'bytes_sent': c.socket.bytes - sent_bytes,
+        'stages': {
+            name: {
+                'count': h.count,
+                'mean': h.total / h.count if h.count else 0.0,
+                'p50': h.percentile(50),
+                'p95': h.percentile(95),
+                'p99': h.percentile(99),
+                'max': h.max,
+            } for name, h in histograms.items()
+        },
+    }
+    if trace_allocations:
+        top = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')[:10]
+        result['allocations'] = {
+            'current_bytes': current,
+            'peak_bytes': peak,
+            'bytes_per_message': current / len(lines) if lines else 0.0,
+            'top': ['{}: {} bytes in {} blocks'.format(s.traceback, s.size, s.count) for s in top],
+        }
+    return result
+
+
+def format_result(result):
+    out = [
+        '{messages} messages in {seconds:.3f}s, {messages_per_second:.0f} msgs/sec'.format(**result),
+        '{lines_sent} lines ({bytes_sent} bytes) sent'.format(**result),
+    ]
+    for name, s in result['stages'].items():
+        out.append('{:<15} {:>8} calls  mean {:8.1f}us  p50 {:8.1f}us  p95 {:8.1f}us  p99 {:8.1f}us  max {:8.1f}us'.format(
+            name, s['count'], s['mean'] * 1e6, s['p50'] * 1e6, s['p95'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6
+        ))
+    if 'allocations' in result:
+        a = result['allocations']
+        out.append('allocated {current_bytes} bytes still held, {peak_bytes} peak, {bytes_per_message:.1f} bytes/message'.format(**a))
+        out.extend('  ' + line for line in a['top'])
+    return '\n'.join(out)
+
+
+def end_to_end(bots=1, channels=10, users=500, messages=10000, rate=0, command_ratio=.1, commands=('!ping',), twitch=False, timeout=60, seed=0, shards=0):
+    # connects real bots to a FakeServer over loopback and measures how long
+    # they take to be ready, and how fast chatter is answered
+    from .supervisor import SharedReactor
+    server = FakeServer(twitch=twitch, flood_rate=0)
+    host, port = server.start()
+    if twitch:
+        channels = 1
+    chans = server.populate(channels, users)
+    reactor = SharedReactor()
+    options = dict(reactor=reactor, load_plugins=False, send_rate=0, log_level='error', log_file=os.devnull, port=port, shards=shards)
+    if twitch:
+        clients = [TwitchBot('bench{}'.format(i), chans[0], 'token', server=host, **options) for i in range(bots)]
+    else:
+        clients = [Bot(chans, 'bench{}'.format(i), host, **options) for i in range(bots)]
+    start = time.perf_counter()
+    for bot in clients:
+        bot._connect()
+    done = threading.Event()
+    def process():
+        while not done.is_set():
+            reactor.process_once(.05)
+    thread = threading.Thread(target=process, name='pinhook-benchmark', daemon=True)
+    thread.start()
+    try:
+        joined = server.wait_for(lambda: server.stats['joins'] >= bots * len(chans), timeout) and server.sync(timeout)
+        ready = time.perf_counter() - start
+        if not joined:
+            raise RuntimeError('bots did not join in {}s: {}'.format(timeout, server.stats))
+        timings = server.timings()
+        received = server.stats['received']
+        start = time.perf_counter()
+        server.chatter(messages, rate, command_ratio, commands, seed=seed)
+        expected = server.stats['sent_commands'] * bots
+        answered = server.wait_for(lambda: server.stats['received'] - received >= expected, timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        done.set()
+        thread.join()
+        for bot in clients:
+            if bot.shard_pool:
+                bot.shard_pool.stop()
+        reactor.disconnect_all()
+        server.stop()
+    registered = sorted(t['registered'] for t in timings if t['registered'] is not None)
+    return {
+        'bots': bots,
+        'channels': len(chans),
+        'ready_seconds': ready,
+        'registered_p50': registered[len(registered) // 2] if registered else None,
+        'registered_max': registered[-1] if registered else None,
+        'messages': messages,
+        'seconds': elapsed,
+        'messages_per_second': messages * bots / elapsed if elapsed else 0.0,
+        'replies': server.stats['received'] - received,
+        'expected_replies': expected,
+        'complete': answered,
+        'server': dict(server.stats),
+    }
+
+
+def format_end_to_end(result):
+    out = [
+        '{bots} bots ready in {channels} channels after {ready_seconds:.3f}s'.format(**result),
+        '{messages} messages to each bot in {seconds:.3f}s, {messages_per_second:.0f} msgs/sec'.format(**result),
+        '{replies} of {expected_replies} replies received'.format(**result),
+    ]
+    if result['registered_p50'] is not None:
+        out.insert(1, 'registration p50 {:.1f}ms, max {:.1f}ms'.format(result['registered_p50'] * 1000, result['registered_max'] * 1000))
+    return '\n'.join(out)
+
+
+def startup(config, runs=10):
+    # wall time of `pinhook --check config` in fresh interpreters, validating
+    # the config and reading it from the cache, next to a bare interpreter
+    check = [sys.executable, '-c', 'from pinhook.cli import cli; cli()', '--check', config]
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, PINHOOK_CACHE_DIR=cache)
+
+        def timed(args):
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL)
+                times.append(time.perf_counter() - start)
+            return sorted(times)
+
+        bare = timed([sys.executable, '-c', 'pass'])
+        uncached = timed(check + ['--no-cache'])
+        cached = timed(check)
+        # the first module of each import is the last part of its line
+        imports = subprocess.run([sys.executable, '-X', 'importtime'] + check[1:], env=env, check=True,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True).stderr
+    modules = {line.rsplit('|', 1)[-1].strip() for line in imports.splitlines() if '|' in line}
+    return {
+        'runs': runs,
+        'interpreter_p50': bare[len(bare) // 2],
+        'uncached_p50': uncached[len(uncached) // 2],
+        'uncached_min': uncached[0],
+        'cached_p50': cached[len(cached) // 2],
+        'cached_min': cached[0],
+        'modules': len(modules),
+        'imports_irc': any(m == 'irc' or m.startswith('irc.') for m in modules),
+        'imports_marshmallow': 'marshmallow' in modules,
+    }
+
+
+def format_startup(result):
+    return '\n'.join([
+        'python alone: p50 {:.1f}ms'.format(result['interpreter_p50'] * 1000),
+        '--check, validating: p50 {:.1f}ms, min {:.1f}ms'.format(result['uncached_p50'] * 1000, result['uncached_min'] * 1000),
+        '--check, cached: p50 {:.1f}ms, min {:.1f}ms'.format(result['cached_p50'] * 1000, result['cached_min'] * 1000),
+        'cached run imports {} modules{}{}'.format(
+            result['modules'],
+            ', including irc' if result['imports_irc'] else '',
+            ', including marshmallow' if result['imports_marshmallow'] else ''
+        ),
+    ])
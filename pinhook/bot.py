@@ -1,11 +1,24 @@
 from collections import OrderedDict
 from datetime import datetime, timezone
-import logging
-import ssl
+import contextlib
+import functools
 import time
 
 from . import log
+from .jobs import Jobs
+from .acl import ACL
+from .output import fit_lines
+from . import metrics
 from . import plugin
+from .ratelimit import SendQueue, Throttle
+from .reconnect import Backoff, join_lines
+from .roster import Roster, fold
+from .shard import ShardPool
+from .store import open_store
+from . import transport
+from .twitch import Tags
+from .watch import PluginWatcher
+from .worker import WorkerPool
 
 import irc.bot
 
@@ -13,7 +26,33 @@ import irc.bot
 irc.client.ServerConnection.buffer_class.errors = 'replace'
 
 
+class _NoReconnect(irc.bot.ReconnectStrategy):
+    def run(self, bot):
+        pass
+
+    def reset(self):
+        pass
+
+
+class _Route:
+    # entry in Bot.dispatch, handler is a bot method for internal commands
+    # or the plugin.Command
+    __slots__ = ('name', 'handler', 'ops', 'command')
+
+    def __init__(self, name, handler, ops, command=None):
+        self.name = name
+        self.handler = handler
+        self.ops = ops
+        self.command = command
+
+
 class Bot(irc.bot.SingleServerIRCBot):
+    public_internal_commands = {'help', 'banlist'}
+    line_limit = 512
+    connect_started = None
+    ready_seconds = None
+    disconnected_at = None
+    rejoin = ()
     internal_commands = {
         'join': 'join a channel',
         'quit': 'force the bot to quit',
@@ -25,84 +64,312 @@ class Bot(irc.bot.SingleServerIRCBot):
         'ops': 'list all ops',
         'ban': 'ban a user from using the bot',
         'unban': 'remove bot ban for user',
-        'banlist': 'currently banned nicks'
+        'banlist': 'currently banned nicks',
+        'stats': 'plugin call counts and latencies, "stats throttle", "stats cache", "stats jobs" and "stats shards" for those counters'
     }
 
     def __init__(self, channels, nickname, server, **kwargs):
-        self.port = kwargs.get('port', 6667)
-        self.ops = kwargs.get('ops', [])
-        self.plugin_dir = kwargs.get('plugin_dir', 'plugins')
+        self._read_options(kwargs)
         self.ssl_required = kwargs.get('ssl_required', False)
+        self.transport = kwargs.get('transport', 'tls' if self.ssl_required else 'tcp')
+        # ssl_required has always meant TLS on the usual port
+        self.port = kwargs.get('port', 6667 if self.ssl_required else transport.default_ports.get(self.transport))
         self.ns_pass = kwargs.get('ns_pass', None)
         self.nickserv = kwargs.get('nickserv', 'NickServ')
+        self.chanlist = channels
+        self.bot_nick = nickname
+        self.start_logging()
+        self._setup(nickname, [(server, self.port, self.server_pass)], kwargs)
+
+    def _read_options(self, kwargs):
+        # options Bot and TwitchBot share, the server and transport are left to each
+        self.acl_file = kwargs.get('acl_file', None)
+        self.acl = ACL(ops=kwargs.get('ops', []), banned=kwargs.get('banned_users', []), path=self.acl_file)
+        self.ops = self.acl.ops
+        self.banned_users = self.acl.banned
+        self.plugin_dir = kwargs.get('plugin_dir', 'plugins')
+        self.ssl_verify = kwargs.get('ssl_verify', True)
+        self.ssl_ca_file = kwargs.get('ssl_ca_file', None)
+        self.ws_path = kwargs.get('ws_path', '/')
         self.log_level = kwargs.get('log_level', 'info')
         self.log_file = kwargs.get('log_file', None)
+        self.log_queue = kwargs.get('log_queue', False)
+        self.log_json = kwargs.get('log_json', False)
+        self.log_max_bytes = kwargs.get('log_max_bytes', 0)
+        self.log_backups = kwargs.get('log_backups', 5)
+        self.log_rotate = kwargs.get('log_rotate', None)
         self.server_pass = kwargs.get('server_pass', None)
         self.cmd_prefix = kwargs.get('cmd_prefix', '!')
         self.use_prefix_for_plugins = kwargs.get('use_prefix_for_plugins', False)
         self.disable_help = kwargs.get('disable_help', False)
-        self.banned_users = kwargs.get('banned_users', [])
-        if self.ssl_required:
-            factory = irc.connection.Factory(wrapper=ssl.wrap_socket)
-            irc.bot.SingleServerIRCBot.__init__(self, [(server, self.port, self.server_pass)], nickname, nickname, connect_factory=factory)
-        else:
-            irc.bot.SingleServerIRCBot.__init__(self, [(server, self.port, self.server_pass)], nickname, nickname)
-        self.chanlist = channels
-        self.bot_nick = nickname
-        self.start_logging()
+        self.send_rate = kwargs.get('send_rate', 2)
+        self.send_burst = kwargs.get('send_burst', 4)
+        self.worker_threads = kwargs.get('worker_threads', 4)
+        self.worker_processes = kwargs.get('worker_processes', None)
+        self.worker_queue_size = kwargs.get('worker_queue_size', 100)
+        self.worker_timeout = kwargs.get('worker_timeout', 30)
+        self.shards = kwargs.get('shards', 0)
+        self.store_file = kwargs.get('store_file', 'pinhook.db')
+        self.store_flush_interval = kwargs.get('store_flush_interval', 5)
+        self.shard_by = kwargs.get('shard_by', 'channel')
+        self.shard_queue_size = kwargs.get('shard_queue_size', 1000)
+        self.shared_reactor = kwargs.get('reactor', None)
+        self.reconnect_min = kwargs.get('reconnect_min', 1)
+        self.reconnect_max = kwargs.get('reconnect_max', 300)
+        self.case_insensitive_commands = kwargs.get('case_insensitive_commands', False)
+        self.incremental_reload = kwargs.get('incremental_reload', False)
+        self.watch_plugins = kwargs.get('watch_plugins', False)
+        self.watch_interval = kwargs.get('watch_interval', 2)
+        self.lazy_plugins = kwargs.get('lazy_plugins', False)
+        self.parallel_imports = kwargs.get('parallel_imports', 0)
+        self.metrics = kwargs.get('metrics', False)
+        self.metrics_port = kwargs.get('metrics_port', None)
+        self.throttle_nick_rate = kwargs.get('throttle_nick_rate', 0)
+        self.throttle_nick_burst = kwargs.get('throttle_nick_burst', 5)
+        self.throttle_host_rate = kwargs.get('throttle_host_rate', 0)
+        self.throttle_host_burst = kwargs.get('throttle_host_burst', 5)
+        self.throttle_channel_rate = kwargs.get('throttle_channel_rate', 0)
+        self.throttle_channel_burst = kwargs.get('throttle_channel_burst', 10)
+
+    def _setup(self, nickname, server_list, kwargs):
+        # everything after the options that Bot and TwitchBot have in common
+        self.connect_factory = self.make_connect_factory()
+        irc.bot.SingleServerIRCBot.__init__(self, server_list, nickname, nickname, recon=Backoff(self.reconnect_min, self.reconnect_max), connect_factory=self.connect_factory)
+        self.channels = Roster()
+        # channels joined but not confirmed yet, for time to ready
+        self.pending_joins = set()
+        self.send_queue = SendQueue(self.reactor.scheduler, rate=self.send_rate, burst=self.send_burst)
+        self.send_queue.batch = self.batch_writes
+        self.throttle = Throttle({
+            'nick': (self.throttle_nick_rate, self.throttle_nick_burst),
+            'host': (self.throttle_host_rate, self.throttle_host_burst),
+            'channel': (self.throttle_channel_rate, self.throttle_channel_burst)
+        })
+        self.workers = kwargs.get('workers') or WorkerPool(
+            self.reactor.scheduler,
+            threads=self.worker_threads,
+            processes=self.worker_processes,
+            queue_size=self.worker_queue_size,
+            timeout=self.worker_timeout
+        )
+        self.jobs = Jobs(self)
+        self.store = open_store(self.store_file, self.store_flush_interval)
+        if self.metrics or self.metrics_port:
+            metrics.enable()
+        if self.metrics_port:
+            metrics.serve(self.metrics_port)
         self.internal_commands = {self.cmd_prefix + k: v for k,v in self.internal_commands.items()}
-        plugin.load_plugins(self.plugin_dir, use_prefix=self.use_prefix_for_plugins, cmd_prefix=self.cmd_prefix)
+        if kwargs.get('load_plugins', True):
+            plugin.load_plugins(
+                self.plugin_dir,
+                use_prefix=self.use_prefix_for_plugins,
+                cmd_prefix=self.cmd_prefix,
+                lazy=self.lazy_plugins,
+                parallel=self.parallel_imports
+            )
+        self.build_dispatch()
+        self.shard_pool = ShardPool(self, self.shards, self.shard_by, self.shard_queue_size, kwargs.get('load_plugins', True)) if self.shards else None
+        if self.watch_plugins:
+            self.watcher = PluginWatcher(
+                self.reactor.scheduler,
+                self.plugin_dir,
+                functools.partial(self.reload_plugins, incremental=True),
+                interval=self.watch_interval
+            )
+
 
     class Message:
-        def __init__(self, bot, channel, nick, user, botnick, ops, logger, action, privmsg, notice, msg_type, cmd=None, arg=None, text=None, nick_list=None):
-            self.bot = bot
-            self.datetime = datetime.now(timezone.utc)
-            self.timestamp = self.datetime.timestamp()
-            self.channel = channel
-            self.nick = nick
-            self.user = user
-            self.nick_list = nick_list
-            self.botnick = botnick
-            self.ops = ops
-            self.logger = logger
-            self.action = action
-            self.privmsg = privmsg
-            self.notice = notice
-            self.msg_type = msg_type
-            if cmd:
-                self.cmd = cmd
-                self.arg = arg
-            if text != None:
-                self.text = text
-            if not (cmd==None or text==None):
-                raise TypeError('missing cmd or text parameter')
+        # one read-only Message is built per event and shared by every plugin
+        # that handles it, the nick list and datetime are only built if used
+        __slots__ = ('bot', 'channel', 'nick', 'user', 'botnick', 'ops', 'logger', 'action', 'privmsg',
+                     'notice', 'msg_type', 'cmd', 'arg', 'text', 'timestamp', 'tags', '_nick_list', '_datetime')
+
+        def __init__(self, bot, channel, nick, user, botnick, ops, logger, action, privmsg, notice, msg_type, cmd=None, arg=None, text=None, nick_list=None, timestamp=None, tags=None):
+            init = object.__setattr__
+            init(self, 'bot', bot)
+            init(self, 'timestamp', time.time() if timestamp is None else timestamp)
+            init(self, 'channel', channel)
+            init(self, 'nick', nick)
+            init(self, 'user', user)
+            init(self, 'botnick', botnick)
+            init(self, 'ops', ops)
+            init(self, 'logger', logger)
+            init(self, 'action', action)
+            init(self, 'privmsg', privmsg)
+            init(self, 'notice', notice)
+            init(self, 'msg_type', msg_type)
+            init(self, 'cmd', cmd)
+            init(self, 'arg', arg)
+            init(self, 'text', text)
+            init(self, 'tags', tags)
+            init(self, '_nick_list', nick_list)
+            init(self, '_datetime', None)
+
+        def __setattr__(self, name, value):
+            raise AttributeError('Message is read-only')
+
+        def __delattr__(self, name):
+            raise AttributeError('Message is read-only')
+
+        @property
+        def datetime(self):
+            if self._datetime is None:
+                object.__setattr__(self, '_datetime', datetime.fromtimestamp(self.timestamp, timezone.utc))
+            return self._datetime
+
+        @property
+        def nick_list(self):
+            if self._nick_list is None:
+                if self.channel == self.nick:
+                    nick_list = (self.nick,)
+                elif self.channel in self.bot.channels:
+                    nick_list = self.bot.channels[self.channel]
+                else:
+                    nick_list = ()
+                object.__setattr__(self, '_nick_list', nick_list)
+            return self._nick_list
+
+    def reactor_class(self):
+        if self.shared_reactor:
+            return self.shared_reactor
+        return irc.client.Reactor()
 
     def start_logging(self):
+        # safe to call for every bot, handlers are only added once per file
         self.logger = log.logger
-        if self.log_file:
-            log.set_log_file(self.log_file)
-        else:
-            log.set_log_file('{}.log'.format(self.bot_nick))
-        if self.log_level == 'error':
-            level = logging.ERROR
-        elif self.log_level == 'warning':
-            level = logging.WARNING
-        elif self.log_level == 'info':
-            level = logging.INFO
-        elif self.log_level == 'debug':
-            level = logging.DEBUG
-        # Set levels
+        log.set_log_file(
+            self.log_file or '{}.log'.format(self.bot_nick),
+            json_lines=self.log_json,
+            max_bytes=self.log_max_bytes,
+            backups=self.log_backups,
+            rotate=self.log_rotate
+        )
+        if self.log_queue:
+            log.start_queue()
         if self.log_level != "off":
-            self.logger.setLevel(level)
+            log.set_level(self.log_level)
         self.logger.info('Logging started!')
 
+    def make_connect_factory(self):
+        context = None
+        if self.transport in ('tls', 'wss'):
+            context = transport.ssl_context(self.ssl_verify, self.ssl_ca_file)
+        return transport.Factory(self.transport, context, self.ws_path)
+
+    def batch_writes(self):
+        # lines sent inside leave in one write when the transport can batch
+        sock = getattr(self.connection, 'socket', None)
+        if hasattr(sock, 'batch'):
+            return sock.batch()
+        return contextlib.nullcontext()
+
+    def _connect(self):
+        # time to ready runs from here until the last channel is joined
+        self.connect_started = time.perf_counter()
+        self.ready_seconds = None
+        self.pending_joins = set()
+        super()._connect()
+
     def on_welcome(self, c, e):
+        self.recon.reset()
+        # nickserv and the joins go out together without waiting on replies
         if self.ns_pass:
             self.logger.info('identifying with nickserv')
             c.privmsg(self.nickserv, 'identify {}'.format(self.ns_pass))
-        for channel in self.chanlist:
-            self.logger.info('joining channel {}'.format(channel.split()[0]))
-            c.join(*channel.split())
+        self.join_channels(c, self.rejoin_list())
+        self.jobs.start()
+
+    def rejoin_list(self):
+        # the configured channels plus any joined since, like with !join
+        channels = list(self.chanlist)
+        configured = {fold(channel.split()[0]) for channel in channels}
+        channels += [chan for chan in self.rejoin if fold(chan) not in configured]
+        return channels
+
+    def join_channels(self, c, channels):
+        targets = getattr(c.features, 'targmax', {}).get('JOIN')
+        lines = join_lines(channels, self.line_length(c), targets)
+        self.pending_joins.update(fold(channel.split()[0]) for channel in channels)
+        self.logger.info('joining %s channels in %s lines', len(channels), len(lines))
+        with self.batch_writes():
+            for line in lines:
+                self.send_queue.put(c.send_raw, line)
+        self._check_ready()
+
+    def _joined(self, channel):
+        if self.pending_joins:
+            self.pending_joins.discard(fold(channel))
+            self._check_ready()
+
+    def _check_ready(self):
+        if self.pending_joins or self.ready_seconds is not None or self.connect_started is None:
+            return
+        self.ready_seconds = time.perf_counter() - self.connect_started
+        if metrics.enabled:
+            metrics.record('reactor', 'ready', self.ready_seconds)
+        if self.disconnected_at is not None:
+            down = time.perf_counter() - self.disconnected_at
+            self.disconnected_at = None
+            if metrics.enabled:
+                metrics.record('reactor', 'recovery', down)
+            self.logger.info('ready in %.2fs, %.2fs after being disconnected', self.ready_seconds, down)
+        else:
+            self.logger.info('ready in %.2fs', self.ready_seconds)
+
+    # a channel that can't be joined doesn't hold up being ready
+    def on_nosuchchannel(self, c, e):
+        self._joined(e.arguments[0])
+
+    on_toomanychannels = on_channelisfull = on_inviteonlychan = on_nosuchchannel
+    on_bannedfromchan = on_badchannelkey = on_nochanmodes = on_nosuchchannel
+
+    # channel users are kept in a Roster instead of irc.bot's per-channel
+    # dicts, these replace the handlers SingleServerIRCBot registers
+    def _on_disconnect(self, c, e):
+        if self.disconnected_at is None:
+            self.disconnected_at = time.perf_counter()
+        if self.channels:
+            self.rejoin = list(self.channels)
+        self.channels.clear()
+        self.recon.run(self)
+
+    def _on_join(self, c, e):
+        if e.source.nick == c.get_nickname():
+            self.channels.add_channel(e.target)
+            self._joined(e.target)
+        self.channels.join(e.target, e.source.nick)
+
+    def _on_part(self, c, e):
+        if e.source.nick == c.get_nickname():
+            self.channels.remove_channel(e.target)
+        else:
+            self.channels.part(e.target, e.source.nick)
+
+    def _on_kick(self, c, e):
+        if e.arguments[0] == c.get_nickname():
+            self.channels.remove_channel(e.target)
+        else:
+            self.channels.part(e.target, e.arguments[0])
+
+    def _on_quit(self, c, e):
+        self.channels.quit(e.source.nick)
+
+    def _on_nick(self, c, e):
+        self.channels.rename(e.source.nick, e.target)
+
+    def _on_namreply(self, c, e):
+        _, channel, nicks = e.arguments
+        self.channels.add_names(channel, nicks.split(), c.features.prefix)
+
+    def _on_mode(self, c, e):
+        if irc.client.is_channel(e.target):
+            self.channels.set_modes(e.target, ' '.join(e.arguments), c.features.prefix)
+
+    def on_join(self, c, e):
+        # the server's view of our own nick!user@host, which is prepended to
+        # everything we send and counts against the line limit
+        if e.source.nick == c.get_nickname():
+            self.self_prefix = e.source
 
     def on_pubmsg(self, c, e):
         self.process_event(c, e)
@@ -120,139 +387,268 @@ class Bot(irc.bot.SingleServerIRCBot):
             cmds.update({k:v.help_text for k,v in plugin.cmds.items() if plugin.cmds[k].ops})
             cmds.update({k:v for k,v in self.internal_commands.items()})
         helpout = OrderedDict(sorted(cmds.items()))
-        for h in helpout:
-            self.connection.privmsg(nick, '{} -- {}'.format(h, helpout[h]))
-            time.sleep(.1)
-        self.connection.privmsg(nick, 'List of listeners: {}'.format(', '.join([l for l in plugin.lstnrs])))
+        with self.batch_writes():
+            for h in helpout:
+                self.send_queue.put(self.connection.privmsg, nick, '{} -- {}'.format(h, helpout[h]))
+            self.send_queue.put(self.connection.privmsg, nick, 'List of listeners: {}'.format(', '.join([l for l in plugin.lstnrs])))
         return None
 
-    def call_internal_commands(self, channel, nick, cmd, text, arg, c):
-        if not cmd.startswith(self.cmd_prefix):
-            return None
-        else:
-            cmd = cmd[len(self.cmd_prefix):]
-        output = None
-        if nick in self.ops:
-            op = True
+    def _internal_join(self, c, channel, nick, arg, mask=None, tags=None):
+        try:
+            c.join(*arg.split())
+            self.logger.info('joining %s per request of %s', arg, nick)
+            return plugin.message('{}: joined {}'.format(nick, arg.split()[0]))
+        except:
+            self.logger.exception('issue with join command: %sjoin #channel <channel key>', self.cmd_prefix)
+
+    def _internal_quit(self, c, channel, nick, arg, mask=None, tags=None):
+        self.logger.info('quitting per request of %s', nick)
+        if not arg:
+            arg = "See y'all later!"
+        c.quit(arg)
+        if self.shared_reactor:
+            # other bots are running on this reactor, only stop this one
+            self.recon = _NoReconnect()
+            self.jobs.stop()
         else:
-            op = False
-        if cmd == 'join' and op:
-            try:
-                c.join(*arg.split())
-                self.logger.info('joining {} per request of {}'.format(arg, nick))
-                output = plugin.message('{}: joined {}'.format(nick, arg.split()[0]))
-            except:
-                self.logger.exception('issue with join command: {}join #channel <channel key>'.format(self.cmd_prefix))
-        elif cmd == 'quit' and op:
-            self.logger.info('quitting per request of {}'.format(nick))
-            if not arg:
-                arg = "See y'all later!"
-            c.quit(arg)
             quit()
-        elif cmd == 'help' and not self.disable_help:
-            self.call_help(nick, op)
-        elif cmd == 'reload' and op:
-            self.logger.info('reloading plugins per request of {}'.format(nick))
-            plugin.load_plugins(self.plugin_dir, use_prefix=self.use_prefix_for_plugins, cmd_prefix=self.cmd_prefix)
-            output = plugin.message('Plugins reloaded')
-        elif cmd == 'enable' and op:
-            if arg in plugin.plugins:
-                if plugin.plugins[arg].enabled:
-                    output = plugin.message("{}: '{}' already enabled".format(nick, arg))
-                else:
-                    plugin.plugins[arg].enable()
-                    output = plugin.message("{}: '{}' enabled!".format(nick, arg))
+
+    def _internal_help(self, c, channel, nick, arg, mask=None, tags=None):
+        self.call_help(nick, self.is_op(nick, tags, mask))
+
+    def reload_plugins(self, incremental=None):
+        if incremental is None:
+            incremental = self.incremental_reload
+        changed = plugin.load_plugins(
+            self.plugin_dir,
+            use_prefix=self.use_prefix_for_plugins,
+            cmd_prefix=self.cmd_prefix,
+            incremental=incremental,
+            lazy=self.lazy_plugins,
+            parallel=self.parallel_imports
+        )
+        self.workers.reset_processes()
+        self.jobs.sync()
+        if self.shard_pool:
+            self.shard_pool.broadcast('reload', incremental)
+        return changed
+
+    def _internal_reload(self, c, channel, nick, arg, mask=None, tags=None):
+        self.logger.info('reloading plugins per request of %s', nick)
+        changed = self.reload_plugins()
+        if self.incremental_reload:
+            return plugin.message('Plugins reloaded: {}'.format(', '.join(changed) or 'no changes'))
+        return plugin.message('Plugins reloaded')
+
+    def _internal_enable(self, c, channel, nick, arg, mask=None, tags=None):
+        if arg in plugin.plugins:
+            if plugin.plugins[arg].enabled:
+                return plugin.message("{}: '{}' already enabled".format(nick, arg))
             else:
-                output = plugin.message("{}: '{}' not found".format(nick, arg))
-        elif cmd == 'disable' and op:
-            if arg in plugin.plugins:
-                if not plugin.plugins[arg].enabled:
-                    output = plugin.message("{}: '{}' already disabled".format(nick, arg))
-                else:
-                    plugin.plugins[arg].disable()
-                    output = plugin.message("{}: '{}' disabled!".format(nick, arg))
-        elif cmd == 'op' and op:
-            for o in arg.split(' '):
-                self.ops.append(o)
-            output = plugin.message('{}: {} added as op'.format(nick, arg))
-        elif cmd == 'deop' and op:
-            for o in arg.split(' '):
-                self.ops = [i for i in self.ops if i != o]
-            output = plugin.message('{}: {} removed as op'.format(nick, arg))
-        elif cmd == 'ops' and op:
-            output = plugin.message('current ops: {}'.format(', '.join(self.ops)))
-        elif cmd == 'ban' and op:
-            for o in arg.split(' '):
-                self.banned_users.append(o)
-            output = plugin.message('{}: banned {}'.format(nick, arg))
-        elif cmd == 'unban' and op:
-            for o in arg.split(' '):
-                self.banned_users = [i for i in self.banned_users if i != o]
-            output = plugin.message('{}: removed ban for {}'.format(nick, arg))
-        elif cmd == 'banlist':
-            output = plugin.message('currently banned: {}'.format(', '.join(self.banned_users)))
-        return output
+                plugin.plugins[arg].enable()
+                if self.shard_pool:
+                    self.shard_pool.broadcast('enable', arg, True)
+                return plugin.message("{}: '{}' enabled!".format(nick, arg))
+        else:
+            return plugin.message("{}: '{}' not found".format(nick, arg))
+
+    def _internal_disable(self, c, channel, nick, arg, mask=None, tags=None):
+        if arg in plugin.plugins:
+            if not plugin.plugins[arg].enabled:
+                return plugin.message("{}: '{}' already disabled".format(nick, arg))
+            else:
+                plugin.plugins[arg].disable()
+                if self.shard_pool:
+                    self.shard_pool.broadcast('enable', arg, False)
+                return plugin.message("{}: '{}' disabled!".format(nick, arg))
 
-    def call_plugins(self, privmsg, action, notice, chan, cmd, text, nick_list, nick, user, arg, msg_type):
+    def _internal_op(self, c, channel, nick, arg, mask=None, tags=None):
+        for o in arg.split():
+            self.acl.add('ops', o)
+        if self.shard_pool:
+            self.shard_pool.broadcast('ops', list(self.ops))
+        return plugin.message('{}: {} added as op'.format(nick, arg))
+
+    def _internal_deop(self, c, channel, nick, arg, mask=None, tags=None):
+        for o in arg.split():
+            self.acl.discard('ops', o)
+        if self.shard_pool:
+            self.shard_pool.broadcast('ops', list(self.ops))
+        return plugin.message('{}: {} removed as op'.format(nick, arg))
+
+    def _internal_ops(self, c, channel, nick, arg, mask=None, tags=None):
+        return plugin.message('current ops: {}'.format(', '.join(self.ops)))
+
+    def _internal_ban(self, c, channel, nick, arg, mask=None, tags=None):
+        for o in arg.split():
+            self.acl.add('banned', o)
+        return plugin.message('{}: banned {}'.format(nick, arg))
+
+    def _internal_unban(self, c, channel, nick, arg, mask=None, tags=None):
+        for o in arg.split():
+            self.acl.discard('banned', o)
+        return plugin.message('{}: removed ban for {}'.format(nick, arg))
+
+    def _internal_banlist(self, c, channel, nick, arg, mask=None, tags=None):
+        return plugin.message('currently banned: {}'.format(', '.join(self.banned_users)))
+
+    def _internal_stats(self, c, channel, nick, arg, mask=None, tags=None):
+        if arg == 'cache':
+            caches = ['{}: {} hits, {} misses, {} evictions, {}/{} entries'.format(k, v.cache.hits, v.cache.misses, v.cache.evictions, len(v.cache), v.cache.size)
+                      for k, v in sorted(plugin.cmds.items()) if v.cache is not None]
+            for line in caches or ['no commands are cached']:
+                self.send_queue.put(c.privmsg, nick, line)
+            return None
+        if arg == 'jobs':
+            for line in [r.summary() for r in self.jobs] or ['no jobs are scheduled']:
+                self.send_queue.put(c.privmsg, nick, line)
+            return None
+        if arg == 'shards':
+            if not self.shard_pool:
+                return plugin.message('{}: plugins are not sharded'.format(nick))
+            return plugin.message('{}: {} events waiting on shards ({}), {} dropped'.format(
+                nick, sum(self.shard_pool.in_flight), ', '.join(map(str, self.shard_pool.in_flight)), self.shard_pool.dropped))
+        if arg == 'throttle':
+            counters = ', '.join('{} {}'.format(k, v) for k, v in self.throttle.counters.items())
+            return plugin.message('{}: throttle {}'.format(nick, counters if self.throttle else 'is not enabled'))
+        if not metrics.enabled:
+            return plugin.message('{}: metrics are not enabled'.format(nick))
+        for line in metrics.report(arg or None) or ['no calls recorded']:
+            self.send_queue.put(c.privmsg, nick, line)
+
+    def build_dispatch(self):
+        table = {}
+        for name in [k[len(self.cmd_prefix):] for k in self.internal_commands] + ['help']:
+            handler = getattr(self, '_internal_' + name, None)
+            if not handler or (name == 'help' and self.disable_help):
+                continue
+            table[self.cmd_prefix + name] = _Route(self.cmd_prefix + name, handler, name not in self.public_internal_commands)
+        alias_prefix = self.cmd_prefix if self.use_prefix_for_plugins else ''
+        for name, command in plugin.cmds.items():
+            route = _Route(name, command, command.ops, command=command)
+            table.setdefault(name, route)
+            for alias in command.aliases:
+                table.setdefault(alias_prefix + alias, route)
+        if self.case_insensitive_commands:
+            table = {k.lower(): v for k, v in reversed(list(table.items()))}
+        self.dispatch = table
+        self.dispatch_generation = plugin.generation
+        self.jobs.sync()
+
+    def find_route(self, cmd):
+        if self.dispatch_generation != plugin.generation:
+            self.build_dispatch()
+        if self.case_insensitive_commands:
+            cmd = cmd.lower()
+        return self.dispatch.get(cmd)
+
+    def parse_tags(self, e):
+        return None
+
+    def is_op(self, nick, tags=None, mask=None):
+        return self.ops.match(nick, mask)
+
+    def is_banned(self, nick, tags=None, mask=None):
+        return self.banned_users.match(nick, mask)
+
+    def call_plugins(self, privmsg, action, notice, chan, cmd, text, nick_list, nick, user, arg, msg_type, route=None, tags=None, op=None):
         output = None
-        if cmd in plugin.cmds:
+        if op is None:
+            op = self.is_op(nick, tags)
+        if route is None and cmd:
+            route = self.find_route(cmd)
+        command = route.command if route else None
+        message = self.Message(
+            bot=self,
+            channel=chan,
+            cmd=route.name if command else cmd,
+            arg=arg,
+            text=text,
+            nick_list=nick_list,
+            nick=nick,
+            user=user,
+            privmsg=privmsg,
+            action=action,
+            notice=notice,
+            botnick=self.bot_nick,
+            ops=self.ops,
+            logger=self.logger,
+            msg_type=msg_type,
+            tags=tags
+        )
+        if command:
             try:
-                if plugin.cmds[cmd].ops and nick not in self.ops:
-                    if plugin.cmds[cmd].ops_msg:
-                        output =  plugin.message(plugin.cmds[cmd].ops_msg)
-                elif plugin.cmds[cmd].enabled:
-                    self.logger.debug('executing {}'.format(cmd))
-                    output = plugin.cmds[cmd].run(self.Message(
-                        bot=self,
-                        channel=chan,
-                        cmd=cmd,
-                        nick_list=nick_list,
-                        nick=nick,
-                        user=user,
-                        arg=arg,
-                        privmsg=privmsg,
-                        action=action,
-                        notice=notice,
-                        botnick=self.bot_nick,
-                        ops=self.ops,
-                        logger=self.logger,
-                        msg_type=msg_type
-                    ))
+                if route.ops and not op:
+                    if command.ops_msg:
+                        output =  plugin.message(command.ops_msg)
+                elif command.enabled:
+                    self.logger.debug('executing %s', route.name)
+                    output = self.run_plugin(command, message, chan)
             except Exception:
-                self.logger.exception('issue with command {}'.format(cmd))
+                self.logger.exception('issue with command %s', route.name)
         else:
-            for lstnr in plugin.lstnrs:
-                if plugin.lstnrs[lstnr].enabled:
+            for lstnr in plugin.match_listeners(text, chan, msg_type):
+                if lstnr.enabled:
                     try:
-                        self.logger.debug('whispering to listener: {}'.format(lstnr))
-                        listen_output = plugin.lstnrs[lstnr].run(self.Message(
-                            bot=self,
-                            channel=chan,
-                            text=text,
-                            nick_list=nick_list,
-                            nick=nick,
-                            user=user,
-                            privmsg=privmsg,
-                            action=action,
-                            notice=notice,
-                            botnick=self.bot_nick,
-                            ops=self.ops,
-                            logger=self.logger,
-                            msg_type=msg_type
-                        ))
+                        self.logger.debug('whispering to listener: %s', lstnr)
+                        listen_output = self.run_plugin(lstnr, message, chan)
                         if listen_output:
                             output = listen_output
                     except Exception:
-                        self.logger.exception('issue with listener {}'.format(lstnr))
+                        self.logger.exception('issue with listener %s', lstnr)
         if output:
-            self.logger.debug(f'returning output: {output.msg}')
+            self.logger.debug('returning output: %s', output.msg)
         return output
 
+    def submit_to_shard(self, chan, cmd, text, nick, user, arg, msg_type, route=None, tags=None, op=False):
+        # ops and enabled checks are done here, running the plugins is up to
+        # the shard, which sends its output back through the reactor
+        command = route.command if route else None
+        if command:
+            if route.ops and not op:
+                return plugin.message(command.ops_msg) if command.ops_msg else None
+            if not command.enabled:
+                return None
+        self.shard_pool.submit(route.name if command else None, cmd, chan, text, nick, user, arg, msg_type,
+                               tags.raw if tags else None, time.time())
+
+    def run_plugin(self, p, message, chan):
+        # lazily loaded plugins are imported here, on the reactor thread
+        p = p.resolve()
+        if not p:
+            return None
+        key = None
+        if p.cache is not None:
+            key = p.cache.key(message)
+            output = p.cache.get(key)
+            if output:
+                return output
+        if not p.executor:
+            if metrics.enabled:
+                output = metrics.call(p.kind, str(p), p.run, message)
+            else:
+                output = p.run(message)
+            if output and p.cache is not None:
+                p.cache.put(key, output)
+            return output
+        self.logger.debug('submitting %s to %s worker', p, p.executor)
+        self.workers.submit(p, message, self._deferred_output(chan, p.cache, key))
+
+    def _deferred_output(self, chan, cache=None, key=None):
+        def send(output):
+            if cache is not None:
+                cache.put(key, output)
+            self.logger.debug('sending deferred output: %s', output.msg)
+            self.process_output(self.connection, chan, output)
+        return send
+
     def process_event(self, c, e):
+        start = time.perf_counter() if metrics.enabled else None
         nick = e.source.nick
+        tags = self.parse_tags(e)
+        if self.banned_users and self.is_banned(nick, tags, e.source):
+            return
         user = e.source.user
-        if nick == self.bot_nick:
-            pass
         if e.arguments:
             text = e.arguments[0]
         else:
@@ -263,88 +659,146 @@ class Bot(irc.bot.SingleServerIRCBot):
             msg_type = e.type
         if e.target == self.bot_nick:
             chan = nick
-            nick_list = [nick]
         else:
             chan = e.target
-            nick_list = list(self.channels[chan].users())
         if e.type == 'action':
-            cmd = ''
-        else:
-            cmd = text.split(' ')[0]
-        self.logger.debug(
-            'Message info: channel: {}, nick: {}, cmd: {}, text: {}'.format(chan, nick, cmd, text)
-        )
-        if len(text.split(' ')) > 1:
-            arg = ''.join([i + ' ' for i in text.split(' ')[1:]]).strip()
+            cmd, arg = '', ''
         else:
-            arg = ''
-        output = self.call_internal_commands(chan, nick, cmd, text, arg, c)
-        if not output:
+            cmd, _, arg = text.partition(' ')
+            arg = arg.strip()
+        self.logger.debug('Message info: channel: %s, nick: %s, cmd: %s, text: %s', chan, nick, cmd, text)
+        route = self.find_route(cmd) if cmd else None
+        if start is not None:
+            metrics.record('reactor', 'parse', time.perf_counter() - start)
+        output = None
+        op = self.is_op(nick, tags, e.source)
+        if route and self.throttle and not op:
+            cost = route.command.cost if route.command else 1
+            if not self.throttle.allow(nick, e.source.host, chan, cost):
+                self.logger.debug('throttled %s from %s in %s', cmd, nick, chan)
+                return
+        if route and not route.command and (op or not route.ops):
+            output = route.handler(c, chan, nick, arg, e.source, tags)
+        if not output and self.shard_pool:
+            output = self.submit_to_shard(chan, cmd, text, nick, user, arg, msg_type, route, tags, op)
+        elif not output:
             plugin_info = {
                 'chan': chan,
                 'cmd': cmd,
                 'text': text,
-                'nick_list': nick_list,
+                'nick_list': None,
                 'nick': nick,
                 'user': user,
                 'arg': arg,
                 'privmsg': c.privmsg,
                 'action': c.action,
                 'notice': c.notice,
-                'msg_type': msg_type
+                'msg_type': msg_type,
+                'route': route,
+                'tags': tags,
+                'op': op
             }
             output = self.call_plugins(**plugin_info)
         if output:
-            self.logger.debug(f'sending output: {output.msg}')
+            self.logger.debug('sending output: %s', output.msg)
             self.process_output(c, chan, output)
 
+    def line_length(self, c):
+        # irc.client refuses to send more than 512 bytes whatever LINELEN says
+        try:
+            return min(int(getattr(c.features, 'linelen', self.line_limit)), self.line_limit)
+        except (AttributeError, TypeError, ValueError):
+            return self.line_limit
+
+    def line_budget(self, c, target, action=False):
+        # bytes of text that fit in one message as other users receive it:
+        # ':nick!user@host PRIVMSG target :text\r\n'
+        prefix = getattr(self, 'self_prefix', None)
+        if not prefix:
+            # assume the longest user and host the server could give us
+            prefix = '{}!~{}@{}'.format(c.get_nickname(), 'u' * 9, 'h' * 63)
+        limit = self.line_length(c)
+        overhead = len(':{} PRIVMSG {} :\r\n'.format(prefix, target).encode('utf-8'))
+        if action:
+            overhead += len('\x01ACTION \x01')
+        return limit - overhead
+
     def process_output(self, c, chan, output):
         if not output.msg:
             return
-        for msg in output.msg:
-            if output.msg_type == plugin.OutputType.Message:
-                self.logger.debug('output message: {}'.format(msg))
-                try:
-                    c.privmsg(chan, msg)
-                except irc.client.MessageTooLong:
-                    self.logger.error('output message too long: {}'.format(msg))
-                    break
-            elif output.msg_type == plugin.OutputType.Action:
-                self.logger.debug('output action: {}'.format(msg))
-                try:
-                    c.action(chan, msg)
-                except irc.client.MessageTooLong:
-                    self.logger.error('output message too long: {}'.format(msg))
-                    break
-            else:
-                self.logger.warning("Unsupported output type '{}'".format(output.msg_type))
-            time.sleep(.5)
+        if output.msg_type == plugin.OutputType.Message:
+            send, action = c.privmsg, False
+        elif output.msg_type == plugin.OutputType.Action:
+            send, action = c.action, True
+        else:
+            self.logger.warning("Unsupported output type '%s'", output.msg_type)
+            return
+        with self.batch_writes():
+            for msg in fit_lines(output.msg, self.line_budget(c, chan, action), getattr(output, 'join', None)):
+                self.logger.debug('output %s: %s', output.msg_type.value, msg)
+                self.send_queue.put(send, chan, msg)
 
 
 class TwitchBot(Bot):
+    # twitch's endpoints for each transport
+    servers = {
+        'tcp': ('irc.twitch.tv', 6667),
+        'tls': ('irc.chat.twitch.tv', 6697),
+        'ws': ('irc-ws.chat.twitch.tv', 80),
+        'wss': ('irc-ws.chat.twitch.tv', 443),
+    }
+    caps = ('twitch.tv/membership', 'twitch.tv/tags', 'twitch.tv/commands')
+    caps_requested = False
+
     def __init__(self, nickname, channel, token, **kwargs):
-        self.port = kwargs.get('port', 6667)
-        self.ops = kwargs.get('ops', [])
-        self.plugin_dir = kwargs.get('plugin_dir', 'plugins')
-        self.log_level = kwargs.get('log_level', 'info')
-        self.log_file = kwargs.get('log_file', None)
-        self.server_pass = kwargs.get('server_pass', None)
-        self.cmd_prefix = kwargs.get('cmd_prefix', '!')
-        self.use_prefix_for_plugins = kwargs.get('use_prefix_for_plugins', False)
-        self.disable_help = kwargs.get('disable_help', False)
-        self.banned_users = kwargs.get('banned_users', [])
+        self._read_options(kwargs)
+        self.transport = kwargs.get('transport', 'tcp')
+        if self.transport not in self.servers:
+            raise ValueError("transport must be one of 'tcp', 'tls', 'ws' or 'wss'")
+        self.server = kwargs.get('server', self.servers[self.transport][0])
+        self.port = kwargs.get('port', self.servers[self.transport][1])
+        self.badge_ops = set(kwargs.get('badge_ops', []))
         self.bot_nick = nickname
         self.start_logging()
         self.channel = channel
+        self.chanlist = [channel]
         self.logger.info('Joining Twitch Server')
-        irc.bot.SingleServerIRCBot.__init__(self, [('irc.twitch.tv', 6667, 'oauth:'+token)], nickname, nickname)
-        self.internal_commands = {self.cmd_prefix + k: v for k,v in self.internal_commands.items()}
-        plugin.load_plugins(self.plugin_dir, use_prefix=self.use_prefix_for_plugins, cmd_prefix=self.cmd_prefix)
+        self._setup(nickname, [(self.server, self.port, 'oauth:'+token)], kwargs)
 
-    def on_welcome(self, c, e):
+    def parse_tags(self, e):
+        return Tags.from_event(e.tags)
+
+    def is_op(self, nick, tags=None, mask=None):
+        # ops can be listed by nick or twitch user-id, or be given by badge
+        if tags is None:
+            return self.ops.match(nick, mask)
+        return self.ops.match(nick, mask, tags.user_id) or not self.badge_ops.isdisjoint(tags.badges)
+
+    def is_banned(self, nick, tags=None, mask=None):
+        return self.banned_users.match(nick, mask, tags.user_id if tags else None)
+
+    def line_budget(self, c, target, action=False):
+        # twitch cuts messages at 500 characters, bytes are never fewer
+        return min(500, super().line_budget(c, target, action))
+
+    def connect(self, *args, **kwargs):
+        super().connect(*args, **kwargs)
+        # asked for along with registration instead of after the welcome
+        if self.connection.is_connected():
+            self.request_caps(self.connection)
+
+    def request_caps(self, c):
         self.logger.info('requesting permissions')
-        c.cap('REQ', ':twitch.tv/membership')
-        c.cap('REQ', ':twitch.tv/tags')
-        c.cap('REQ', ':twitch.tv/commands')
-        self.logger.info('Joining channel ' + self.channel)
-        c.join(self.channel)
+        c.cap('REQ', ':' + ' '.join(self.caps))
+        self.caps_requested = True
+
+    def _connect(self):
+        self.caps_requested = False
+        super()._connect()
+
+    def on_welcome(self, c, e):
+        self.recon.reset()
+        if not self.caps_requested:
+            self.request_caps(c)
+        self.join_channels(c, self.rejoin_list())
+        self.jobs.start()
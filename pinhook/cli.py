@@ -1,60 +1,233 @@
+import hashlib
+import json
+import os
+
 import click
-from .bot import Bot
-from marshmallow import Schema, fields, validate, INCLUDE
-
-class Config(Schema):
-    nickname = fields.Str(required=True)
-    channels = fields.List(fields.Str(), required=True)
-    server = fields.Str(required=True)
-    port = fields.Int()
-    ops = fields.List(fields.Str())
-    ssl_required = fields.Bool()
-    plugin_dir = fields.Str()
-    ns_pass = fields.Str()
-    log_level = fields.Str(validate=validate.OneOf(['debug', 'warn', 'info', 'off', 'error']))
-    server_pass = fields.Str()
-
-    class Meta:
-        unknown = INCLUDE
-
-def read_conf(config, conf_format):
-    schema = Config()
-    if not conf_format:
-        if config.name.endswith('.json'):
-            conf_format = 'json'
-        elif config.name.endswith(('.yaml', '.yml')):
-            conf_format = 'yaml'
-        elif config.name.endswith(('.toml', '.tml')):
-            conf_format = 'toml'
-        else:
-            raise click.ClickException('Could not detect file format, please supply using --format option')
+
+from .__version__ import __version__
+
+# validated configs are cached here, keyed by the config file's path
+cache_dir = os.environ.get('PINHOOK_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')), 'pinhook'
+)
+# the settings the bots of `pinhook a.yaml b.yaml` share, taken from the first
+_shared = ('plugin_dir', 'use_prefix_for_plugins', 'log_file', 'lazy_plugins', 'parallel_imports',
+           'watch_plugins', 'watch_interval', 'worker_threads', 'worker_processes', 'worker_queue_size',
+           'worker_timeout')
+
+
+def __getattr__(name):
+    # the schemas moved to pinhook.config, which is only imported when a
+    # config has to be validated
+    if name in ('Config', 'TwitchConfig', 'SupervisorConfig'):
+        from . import config
+        return getattr(config, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def detect_format(filename):
+    if filename.endswith('.json'):
+        return 'json'
+    elif filename.endswith(('.yaml', '.yml')):
+        return 'yaml'
+    elif filename.endswith(('.toml', '.tml')):
+        return 'toml'
+    raise click.ClickException('Could not detect file format, please supply using --format option')
+
+
+def parse_conf(config, conf_format):
+    conf_format = conf_format or detect_format(config.name)
     if conf_format == 'json':
-        import json
-        to_json = json.loads(config.read())
-        output = schema.load(to_json)
+        return json.loads(config.read())
     elif conf_format == 'yaml':
         try:
             import yaml
         except ImportError:
             raise click.ClickException('yaml not installed, please use `pip3 install pinhook[yaml]` to install')
-        else:
-            to_yaml = yaml.load(config.read(), Loader=yaml.FullLoader)
-            output = schema.load(to_yaml)
+        return yaml.load(config.read(), Loader=yaml.FullLoader)
     elif conf_format == 'toml':
         try:
             import toml
         except ImportError:
-            raise click.ClicKException('toml not installed, please use `pip3 install pinhook[toml]` to install')
+            raise click.ClickException('toml not installed, please use `pip3 install pinhook[toml]` to install')
+        return toml.load(config.name)
+
+
+def read_conf(config, conf_format, schema=None):
+    if schema is None:
+        from .config import Config
+        schema = Config()
+    return schema.load(parse_conf(config, conf_format))
+
+
+def _cache_file(path):
+    return os.path.join(cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json')
+
+
+def _cache_key(path, conf_format, kind):
+    # a changed config file, schema or pinhook version invalidates the entry
+    conf = os.stat(path)
+    schema = os.stat(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.py'))
+    return [kind, conf_format, conf.st_mtime_ns, conf.st_size, schema.st_mtime_ns, __version__]
+
+
+def _read_cache(path, key):
+    try:
+        with open(_cache_file(path)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('key') != key:
+        return None
+    return entry['config']
+
+
+def _write_cache(path, key, config):
+    # configs hold passwords and tokens, so the cache is only readable by
+    # its owner
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        filename = _cache_file(path)
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'path': path, 'key': key, 'config': config}, f)
+        os.replace(tmp, filename)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def load_conf(path, conf_format=None, kind='irc', cache=True):
+    # the validated config in `path`, from the cache when the file hasn't
+    # changed since it was last validated. Only a miss imports marshmallow
+    path = os.path.abspath(path)
+    key = _cache_key(path, conf_format, kind) if cache else None
+    if cache:
+        config = _read_cache(path, key)
+        if config is not None:
+            return config
+    from . import config as schemas
+    with open(path, 'rb') as f:
+        data = parse_conf(f, conf_format)
+    try:
+        config = schemas.load(data, kind)
+    except schemas.ValidationError as e:
+        messages = e.messages
+        if isinstance(messages, list):
+            messages = '; '.join(str(m) for m in messages)
+        raise click.ClickException(str(messages))
+    if cache:
+        _write_cache(path, key, config)
+    return config
+
+
+def _load_all(configs, conf_format, kind, cache, check):
+    # with --check every config is validated and reported before failing
+    loaded = []
+    failed = False
+    for path in configs:
+        try:
+            loaded.append(load_conf(path, conf_format, kind, cache))
+        except click.ClickException as e:
+            message = '{}: {}'.format(path, e.message)
+            if not check:
+                raise click.ClickException(message)
+            click.echo(message, err=True)
+            failed = True
         else:
-            to_toml = toml.load(config.name)
-            output = schema.load(to_toml)
-    return output
+            if check:
+                click.echo('{}: ok'.format(path))
+    if failed:
+        raise SystemExit(1)
+    return loaded
+
+
+@click.command()
+@click.argument('configs', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', '-f', 'conf_format', type=click.Choice(['json', 'yaml', 'toml']))
+@click.option('--check', is_flag=True, help='validate the configs and exit without connecting')
+@click.option('--no-cache', is_flag=True, help='validate the configs again even if they are unchanged')
+def cli(configs, conf_format, check, no_cache):
+    configs = _load_all(configs, conf_format, 'irc', not no_cache, check)
+    if check:
+        return
+    if len(configs) == 1:
+        from .bot import Bot
+        bot = Bot(**configs[0])
+        bot.start()
+        return
+    # several bots share one reactor, like with pinhook-supervisor
+    from .supervisor import Supervisor
+    shared = {k: v for k, v in configs[0].items() if k in _shared}
+    supervisor = Supervisor([dict(config, type='irc') for config in configs], **shared)
+    supervisor.start()
 
 @click.command()
-@click.argument('config', type=click.File('rb'))
+@click.argument('config', type=click.Path(exists=True, dir_okay=False))
 @click.option('--format', '-f', 'conf_format', type=click.Choice(['json', 'yaml', 'toml']))
-def cli(config, conf_format):
-    config = read_conf(config, conf_format)
-    bot = Bot(**config)
-    bot.start()
+@click.option('--check', is_flag=True, help='validate the config and exit without connecting')
+@click.option('--no-cache', is_flag=True, help='validate the config again even if it is unchanged')
+def supervise(config, conf_format, check, no_cache):
+    config = _load_all([config], conf_format, 'supervisor', not no_cache, check)[0]
+    if check:
+        return
+    from .supervisor import Supervisor
+    bots = config.pop('bots')
+    supervisor = Supervisor(bots, **config)
+    supervisor.start()
+
 
+@click.command()
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False), help='file of raw server lines to replay instead of synthetic chatter')
+@click.option('--plugin-dir', help='load real plugins instead of synthetic ones')
+@click.option('--nick', default='bot', show_default=True)
+@click.option('--channels', default=10, show_default=True)
+@click.option('--nicks', default=500, show_default=True, help='users in each channel')
+@click.option('--messages', default=10000, show_default=True)
+@click.option('--commands', default=10, show_default=True, help='synthetic commands to register')
+@click.option('--listeners', default=50, show_default=True, help='synthetic listeners to register')
+@click.option('--command-ratio', default=.1, show_default=True, help='share of messages that are commands')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--trace-allocations', is_flag=True, help='track allocations with tracemalloc, much slower')
+@click.option('--json', 'as_json', is_flag=True, help='print the results as json')
+@click.option('--min-rate', type=float, help='exit with an error below this many messages per second')
+@click.option('--end-to-end', is_flag=True, help='connect bots to a local fake server instead of replaying into one bot')
+@click.option('--bots', default=1, show_default=True, help='bots to connect with --end-to-end')
+@click.option('--twitch', is_flag=True, help='use TwitchBots and a Twitch-like server with --end-to-end')
+@click.option('--rate', default=0.0, show_default=True, help='messages per second sent by the fake server, 0 for as fast as possible')
+@click.option('--shards', default=0, show_default=True, help='plugin shard processes per bot with --end-to-end')
+@click.option('--startup', type=click.Path(exists=True, dir_okay=False), help='time starting `pinhook --check` on this config instead')
+@click.option('--runs', default=10, show_default=True, help='interpreters to start for each case with --startup')
+@click.option('--max-startup', type=float, help='exit with an error if a cached --startup check takes longer, in milliseconds')
+def benchmark(replay, plugin_dir, nick, channels, nicks, messages, commands, listeners, command_ratio, seed, trace_allocations, as_json, min_rate, end_to_end, bots, twitch, rate, shards, startup, runs, max_startup):
+    from . import benchmark as bench
+    if startup:
+        result = bench.startup(startup, runs)
+        click.echo(json.dumps(result, indent=2) if as_json else bench.format_startup(result))
+        if max_startup and result['cached_p50'] * 1000 > max_startup:
+            raise click.ClickException('startup took {:.0f}ms, more than the maximum of {:.0f}ms'.format(result['cached_p50'] * 1000, max_startup))
+        return
+    if end_to_end:
+        if plugin_dir:
+            bench.plugin.load_plugins(plugin_dir)
+            names = [k for k, v in bench.plugin.cmds.items() if not v.ops]
+        else:
+            names = bench.register_plugins(commands, listeners)
+        result = bench.end_to_end(bots, channels, nicks, messages, rate, command_ratio, names, twitch=twitch, seed=seed, shards=shards)
+        click.echo(json.dumps(result, indent=2) if as_json else bench.format_end_to_end(result))
+        if min_rate and result['messages_per_second'] < min_rate:
+            raise click.ClickException('{:.0f} msgs/sec is below the minimum of {:.0f}'.format(result['messages_per_second'], min_rate))
+        return
+    bot = bench.make_bot(plugin_dir, botnick=nick)
+    if plugin_dir:
+        names = [k for k, v in bench.plugin.cmds.items() if not v.ops]
+    else:
+        names = bench.register_plugins(commands, listeners)
+    if replay:
+        setup, lines = [], bench.read_stream(replay)
+    else:
+        setup, lines = bench.synthetic_stream(channels, nicks, messages, command_ratio, names, botnick=nick, seed=seed)
+    result = bench.run(bot, lines, setup, trace_allocations=trace_allocations)
+    click.echo(json.dumps(result, indent=2) if as_json else bench.format_result(result))
+    if min_rate and result['messages_per_second'] < min_rate:
+        raise click.ClickException('{:.0f} msgs/sec is below the minimum of {:.0f}'.format(result['messages_per_second'], min_rate))
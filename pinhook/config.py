@@ -0,0 +1,155 @@
+from marshmallow import Schema, fields, validate, INCLUDE, ValidationError
+
+
+class Config(Schema):
+    nickname = fields.Str(required=True)
+    channels = fields.List(fields.Str(), required=True)
+    server = fields.Str(required=True)
+    port = fields.Int()
+    ops = fields.List(fields.Str())
+    ssl_required = fields.Bool()
+    plugin_dir = fields.Str()
+    ns_pass = fields.Str()
+    log_level = fields.Str(validate=validate.OneOf(['debug', 'warn', 'info', 'off', 'error']))
+    log_queue = fields.Bool()
+    log_json = fields.Bool()
+    log_max_bytes = fields.Int()
+    log_backups = fields.Int()
+    log_rotate = fields.Str()
+    server_pass = fields.Str()
+    send_rate = fields.Float()
+    send_burst = fields.Int()
+    worker_threads = fields.Int()
+    worker_processes = fields.Int()
+    worker_queue_size = fields.Int()
+    worker_timeout = fields.Float()
+    case_insensitive_commands = fields.Bool()
+    incremental_reload = fields.Bool()
+    watch_plugins = fields.Bool()
+    watch_interval = fields.Float()
+    lazy_plugins = fields.Bool()
+    parallel_imports = fields.Int()
+    metrics = fields.Bool()
+    metrics_port = fields.Int()
+    banned_users = fields.List(fields.Str())
+    acl_file = fields.Str()
+    throttle_nick_rate = fields.Float()
+    throttle_nick_burst = fields.Int()
+    throttle_host_rate = fields.Float()
+    throttle_host_burst = fields.Int()
+    throttle_channel_rate = fields.Float()
+    throttle_channel_burst = fields.Int()
+    shards = fields.Int()
+    shard_by = fields.Str(validate=validate.OneOf(['channel', 'command']))
+    shard_queue_size = fields.Int()
+    store_file = fields.Str()
+    store_flush_interval = fields.Float()
+    reconnect_min = fields.Float()
+    reconnect_max = fields.Float()
+    transport = fields.Str(validate=validate.OneOf(['tcp', 'tls', 'ws', 'wss']))
+    ssl_verify = fields.Bool()
+    ssl_ca_file = fields.Str()
+    ws_path = fields.Str()
+
+    class Meta:
+        unknown = INCLUDE
+
+
+class TwitchConfig(Schema):
+    nickname = fields.Str(required=True)
+    channel = fields.Str(required=True)
+    token = fields.Str(required=True)
+    ops = fields.List(fields.Str())
+    plugin_dir = fields.Str()
+    log_level = fields.Str(validate=validate.OneOf(['debug', 'warn', 'info', 'off', 'error']))
+    log_queue = fields.Bool()
+    log_json = fields.Bool()
+    log_max_bytes = fields.Int()
+    log_backups = fields.Int()
+    log_rotate = fields.Str()
+    send_rate = fields.Float()
+    send_burst = fields.Int()
+    badge_ops = fields.List(fields.Str())
+    banned_users = fields.List(fields.Str())
+    acl_file = fields.Str()
+    throttle_nick_rate = fields.Float()
+    throttle_nick_burst = fields.Int()
+    throttle_host_rate = fields.Float()
+    throttle_host_burst = fields.Int()
+    throttle_channel_rate = fields.Float()
+    throttle_channel_burst = fields.Int()
+    shards = fields.Int()
+    shard_by = fields.Str(validate=validate.OneOf(['channel', 'command']))
+    shard_queue_size = fields.Int()
+    store_file = fields.Str()
+    store_flush_interval = fields.Float()
+    reconnect_min = fields.Float()
+    reconnect_max = fields.Float()
+    transport = fields.Str(validate=validate.OneOf(['tcp', 'tls', 'ws', 'wss']))
+    ssl_verify = fields.Bool()
+    ssl_ca_file = fields.Str()
+    ws_path = fields.Str()
+
+    class Meta:
+        unknown = INCLUDE
+
+
+class SupervisorConfig(Schema):
+    bots = fields.List(fields.Dict(), required=True)
+    plugin_dir = fields.Str()
+    log_file = fields.Str()
+    log_level = fields.Str(validate=validate.OneOf(['debug', 'warn', 'info', 'off', 'error']))
+    log_queue = fields.Bool()
+    log_json = fields.Bool()
+    log_max_bytes = fields.Int()
+    log_backups = fields.Int()
+    log_rotate = fields.Str()
+    worker_threads = fields.Int()
+    worker_processes = fields.Int()
+    worker_queue_size = fields.Int()
+    worker_timeout = fields.Float()
+    watch_plugins = fields.Bool()
+    watch_interval = fields.Float()
+    lazy_plugins = fields.Bool()
+    parallel_imports = fields.Int()
+    metrics = fields.Bool()
+    metrics_port = fields.Int()
+    store_file = fields.Str()
+    store_flush_interval = fields.Float()
+
+    class Meta:
+        unknown = INCLUDE
+
+
+bot_schemas = {'irc': Config, 'twitch': TwitchConfig}
+
+
+def load(data, kind='irc'):
+    # validated config for one bot of `kind`, or for the supervisor and
+    # every bot it runs. Raises ValidationError
+    if kind == 'supervisor':
+        return load_supervisor(data)
+    return bot_schemas[kind]().load(data)
+
+
+def load_supervisor(data):
+    config = SupervisorConfig().load(data)
+    if 'acl_file' in config:
+        raise ValidationError('acl_file has to be set for each bot, bots sharing one would share their ops and bans')
+    bots = config.pop('bots')
+    for i, bot in enumerate(bots):
+        # top level keys are defaults for every bot
+        bot = dict(config, **bot)
+        bot_type = bot.get('type', 'irc')
+        if bot_type not in bot_schemas:
+            raise ValidationError("bot {}: unknown type '{}'".format(i, bot_type))
+        try:
+            bots[i] = bot_schemas[bot_type]().load({k: v for k, v in bot.items() if k != 'type'})
+        except ValidationError as e:
+            raise ValidationError('bot {}: {}'.format(i, e.messages))
+        bots[i]['type'] = bot_type
+    acl_files = [bot['acl_file'] for bot in bots if bot.get('acl_file')]
+    if len(set(acl_files)) < len(acl_files):
+        raise ValidationError('bots need an acl_file each, not a shared one')
+    config['bots'] = bots
+    return config
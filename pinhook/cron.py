@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import time
+
+# minute, hour, day of month, month, day of week (0 or 7 is sunday)
+_bounds = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+_aliases = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        spec, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (int(v) for v in spec.split('-', 1))
+        else:
+            start = int(spec)
+            end = high if step > 1 else start
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError('{!r} is out of range {}-{}'.format(part, low, high))
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class Cron:
+    # standard five field cron expression, evaluated in local time
+    def __init__(self, expr):
+        self.expr = expr
+        fields = _aliases.get(expr.strip(), expr).split()
+        if len(fields) != 5:
+            raise ValueError('cron expression needs 5 fields: {!r}'.format(expr))
+        try:
+            parsed = [_parse_field(f, low, high) for f, (low, high) in zip(fields, _bounds)]
+        except ValueError as e:
+            raise ValueError('invalid cron expression {!r}: {}'.format(expr, e)) from None
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(d % 7 for d in weekdays)
+        # when both are restricted a day matches if either does
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        # '0 0 30 2 *' is in range but never comes, better found at import
+        # than when the bot connects
+        self.next(time.time())
+
+    def __repr__(self):
+        return 'Cron({!r})'.format(self.expr)
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after):
+        # first matching minute after the `after` timestamp
+        t = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 8)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t.timestamp()
+        raise ValueError('cron expression {!r} never matches'.format(self.expr))
@@ -0,0 +1,533 @@
+import asyncio
+from collections import deque
+import itertools
+import random
+import threading
+import time
+import zlib
+
+from .log import logger
+from .ratelimit import TokenBucket
+from .transport import ws_accept, ws_frame, ws_parse
+
+TWITCH_CAPS = {'twitch.tv/membership', 'twitch.tv/tags', 'twitch.tv/commands'}
+
+
+def parse_line(line):
+    # returns (command, params), tags and prefix sent by clients are ignored
+    if line.startswith('@'):
+        _, _, line = line.partition(' ')
+    if line.startswith(':'):
+        _, _, line = line.partition(' ')
+    line, sep, trailing = line.partition(' :')
+    params = line.split()
+    if not params:
+        return None, []
+    if sep:
+        params.append(trailing)
+    return params[0].upper(), params[1:]
+
+
+class _Client:
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+        self.nick = None
+        self.user = None
+        self.password = None
+        self.registered = False
+        self.caps = set()
+        self.channels = set()
+        self.connected_at = time.monotonic()
+        self.registered_at = None
+        self.ready_at = None
+        self.bucket = TokenBucket(server.flood_rate, server.flood_burst)
+        self.received = 0
+        self.pending_pong = None
+
+    @property
+    def host(self):
+        if self.server.twitch:
+            return '{}.tmi.twitch.tv'.format(self.nick)
+        return 'fake.host'
+
+    @property
+    def prefix(self):
+        return '{}!{}@{}'.format(self.nick, self.user or self.nick, self.host)
+
+    def send(self, line):
+        if self.writer.is_closing():
+            return
+        if self.server.websocket:
+            self.writer.write(ws_frame(0x1, line.encode('utf-8', 'replace'), mask=False))
+        else:
+            self.writer.write(line.encode('utf-8', 'replace') + b'\r\n')
+
+    def numeric(self, code, *params):
+        params = list(params)
+        if params:
+            params[-1] = ':' + params[-1]
+        self.send(' '.join([':' + self.server.name, code, self.nick or '*'] + params))
+
+
+class _Channel:
+    def __init__(self, name):
+        self.name = name
+        self.topic = ''
+        self.clients = {}
+        # simulated members, they only exist as nicks in NAMES and as the
+        # source of chatter
+        self.users = []
+
+
+class FakeServer:
+    # in-process stand-in for an IRC or Twitch server, speaking enough of the
+    # protocol for a Bot or TwitchBot to connect, identify, join and chat
+    def __init__(self, host='127.0.0.1', port=0, twitch=False, flood_rate=None, flood_burst=None,
+                 flood_action='kill', nickserv_password=None, names_per_line=50, motd=('fake server for pinhook',),
+                 ssl_context=None, websocket=False):
+        self.host = host
+        self.port = port
+        # a server side SSLContext for TLS, and websocket framing on top
+        self.ssl_context = ssl_context
+        self.websocket = websocket
+        self.twitch = twitch
+        self.name = 'tmi.twitch.tv' if twitch else 'irc.test'
+        # twitch allows 20 messages every 30 seconds, ircds about one every 2
+        # seconds after a burst
+        if flood_rate is None:
+            flood_rate = 20 / 30 if twitch else 0.5
+        if flood_burst is None:
+            flood_burst = 20 if twitch else 10
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.flood_action = flood_action
+        self.nickserv_password = nickserv_password
+        self.names_per_line = names_per_line
+        self.motd = motd
+        self.clients = {}
+        self.channels = {}
+        self.messages = deque(maxlen=1000)
+        self.stats = {
+            'connections': 0,
+            'registered': 0,
+            'joins': 0,
+            'received': 0,
+            'sent_chatter': 0,
+            'sent_commands': 0,
+            'flood_drops': 0,
+            'flood_kills': 0,
+        }
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._user_ids = itertools.count(1000)
+        self._connections = set()
+
+    # running
+
+    def start(self):
+        # runs the server on its own event loop in a daemon thread and
+        # returns once it is listening
+        ready = threading.Event()
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self._server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port, ssl=self.ssl_context))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+        self._thread = threading.Thread(target=run, name='pinhook-fakeserver', daemon=True)
+        self._thread.start()
+        ready.wait()
+        logger.info('fake server listening on %s:%s', self.host, self.port)
+        return self.host, self.port
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            # closing the connections ends their handlers
+            for client in list(self._connections):
+                client.writer.close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=5)
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def call(self, func, *args):
+        # runs func on the server's loop and waits for its result
+        async def wrapper():
+            result = func(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+        return asyncio.run_coroutine_threadsafe(wrapper(), self.loop).result()
+
+    # simulated load
+
+    def populate(self, channels=10, users=100, prefix='user'):
+        # adds simulated users to channels, which can be a count or names
+        if isinstance(channels, int):
+            channels = ['#chan{}'.format(i) for i in range(channels)]
+        nicks = ['{}{}'.format(prefix, i) for i in range(users)]
+        def add():
+            for name in channels:
+                self._channel(name).users.extend(nicks)
+            return channels
+        return self.call(add)
+
+    def chatter(self, messages=1000, rate=0, command_ratio=.1, commands=('!ping',), words=None, seed=0):
+        # sends messages from simulated users to channels with a connected
+        # client, rate is messages per second or 0 for as fast as possible
+        words = words or ('hello', 'world', 'python', 'irc', 'bot', 'coffee', 'music', 'today')
+        rng = random.Random(seed)
+        async def send():
+            channels = [c for c in self.channels.values() if c.clients and c.users]
+            if not channels:
+                return 0
+            start = time.monotonic()
+            for i in range(messages):
+                chan = rng.choice(channels)
+                if commands and rng.random() < command_ratio:
+                    text = '{} {}'.format(rng.choice(commands), rng.choice(words))
+                    self.stats['sent_commands'] += 1
+                else:
+                    text = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 10)))
+                self.say(rng.choice(chan.users), chan.name, text)
+                if rate:
+                    delay = start + (i + 1) / rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if i % 100 == 99:
+                    await self._drain()
+            return messages
+        return self.call(send)
+
+    def say(self, nick, channel, text):
+        # delivers a PRIVMSG from a simulated user, only call on the loop
+        chan = self.channels.get(channel.lower())
+        if not chan:
+            return
+        source = '{0}!{0}@{1}'.format(nick, '{}.tmi.twitch.tv'.format(nick) if self.twitch else 'sim.host')
+        for client in chan.clients.values():
+            line = ':{} PRIVMSG {} :{}'.format(source, chan.name, text)
+            if 'twitch.tv/tags' in client.caps:
+                # the first simulated user of a channel is its moderator
+                line = self._tags(nick, bool(chan.users) and chan.users[0] == nick) + ' ' + line
+            client.send(line)
+        self.stats['sent_chatter'] += 1
+
+    async def _drain(self):
+        for client in list(self.clients.values()):
+            try:
+                await client.writer.drain()
+            except ConnectionError:
+                pass
+
+    def wait_for(self, condition, timeout=10, interval=.01):
+        # polls condition() on the server loop until it is true
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.call(condition):
+                return True
+            time.sleep(interval)
+        return False
+
+    def sync(self, timeout=10):
+        # pings every client and waits for all the answers, clients handle
+        # lines in order so everything sent before has been processed
+        token = 'sync{}'.format(next(self._user_ids))
+        def ping():
+            clients = [c for c in self.clients.values() if c.registered]
+            for client in clients:
+                client.pending_pong = token
+                client.send('PING :' + token)
+            return clients
+        clients = self.call(ping)
+        return self.wait_for(lambda: all(c.pending_pong is None for c in clients), timeout)
+
+    def timings(self):
+        # seconds from connecting to registration and to the first JOIN
+        def collect():
+            return [
+                {
+                    'nick': c.nick,
+                    'registered': c.registered_at - c.connected_at if c.registered_at else None,
+                    'ready': c.ready_at - c.connected_at if c.ready_at else None,
+                    'channels': len(c.channels),
+                    'received': c.received,
+                } for c in self.clients.values()
+            ]
+        return self.call(collect)
+
+    # protocol
+
+    def _tags(self, nick, mod):
+        user_id = zlib.crc32(nick.encode('utf-8'))
+        return '@badge-info=;badges={};color=;display-name={};emotes=;first-msg=0;id={};mod={};room-id=1;subscriber=0;tmi-sent-ts={};turbo=0;user-id={};user-type={}'.format(
+            'moderator/1' if mod else '', nick, next(self._user_ids), int(mod),
+            int(time.time() * 1000), user_id, 'mod' if mod else ''
+        )
+
+    def _channel(self, name):
+        key = name.lower()
+        if key not in self.channels:
+            self.channels[key] = _Channel(name)
+        return self.channels[key]
+
+    async def _handle(self, reader, writer):
+        client = _Client(self, writer)
+        self._connections.add(client)
+        self.stats['connections'] += 1
+        try:
+            async for line in self._lines(reader, writer):
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                if not line:
+                    continue
+                if client.registered and not client.bucket.consume():
+                    if self._flood(client):
+                        break
+                    continue
+                command, params = parse_line(line)
+                handler = getattr(self, '_on_' + (command or '').lower(), None)
+                if handler:
+                    handler(client, params)
+                elif client.registered:
+                    client.numeric('421', command or '', 'Unknown command')
+                if client.writer.is_closing():
+                    break
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(client)
+            self._quit(client, 'Connection closed')
+            writer.close()
+
+    async def _lines(self, reader, writer):
+        if not self.websocket:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield line
+        head = await reader.readuntil(b'\r\n\r\n')
+        headers = dict(
+            (k.strip().lower(), v.strip()) for k, _, v in
+            (line.partition(':') for line in head.decode('latin-1').split('\r\n')[1:])
+        )
+        if headers.get('upgrade', '').lower() != 'websocket' or 'sec-websocket-key' not in headers:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+            return
+        writer.write(
+            'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {}\r\n\r\n'.format(ws_accept(headers['sec-websocket-key'].encode('ascii')).decode('ascii')).encode('ascii')
+        )
+        buffer = bytearray()
+        message = bytearray()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            buffer += data
+            frames, used = ws_parse(buffer)
+            del buffer[:used]
+            for fin, opcode, payload in frames:
+                # close, ping, then text, binary and continuation frames
+                if opcode == 0x8:
+                    return
+                elif opcode == 0x9:
+                    writer.write(ws_frame(0xA, payload, mask=False))
+                elif opcode in (0x0, 0x1, 0x2):
+                    message += payload
+                    if fin:
+                        for line in bytes(message).split(b'\n'):
+                            yield line
+                        message = bytearray()
+
+    def _flood(self, client):
+        if self.twitch:
+            client.send(':tmi.twitch.tv NOTICE * :Your message was not sent because you are sending messages too quickly.')
+            self.stats['flood_drops'] += 1
+            return False
+        if self.flood_action == 'kill':
+            client.send('ERROR :Closing Link: {} (Excess Flood)'.format(client.nick))
+            self.stats['flood_kills'] += 1
+            return True
+        client.send(':{} NOTICE {} :Message dropped, flood limit reached'.format(self.name, client.nick))
+        self.stats['flood_drops'] += 1
+        return False
+
+    def _quit(self, client, reason):
+        for key in list(client.channels):
+            chan = self.channels[key]
+            chan.clients.pop(client.nick.lower(), None)
+            for other in chan.clients.values():
+                other.send(':{} QUIT :{}'.format(client.prefix, reason))
+        client.channels.clear()
+        if client.nick and self.clients.get(client.nick.lower()) is client:
+            del self.clients[client.nick.lower()]
+
+    def _register(self, client):
+        if client.registered or not (client.nick and client.user):
+            return
+        if self.twitch and not (client.password or '').startswith('oauth:'):
+            client.send(':tmi.twitch.tv NOTICE * :Login authentication failed')
+            client.writer.close()
+            return
+        client.registered = True
+        client.registered_at = time.monotonic()
+        self.stats['registered'] += 1
+        client.numeric('001', 'Welcome, GLHF!' if self.twitch else 'Welcome to the fake network {}'.format(client.prefix))
+        client.numeric('002', 'Your host is {}'.format(self.name))
+        client.numeric('003', 'This server is rather new')
+        if not self.twitch:
+            client.numeric('004', self.name, 'fake-1.0', 'i', 'ov')
+            client.numeric('005', 'CHANTYPES=#', 'PREFIX=(ov)@+', 'NICKLEN=30', 'are supported by this server')
+        client.numeric('375', '-')
+        for line in self.motd:
+            client.numeric('372', '- ' + line)
+        client.numeric('376', 'End of /MOTD command')
+
+    def _on_pass(self, client, params):
+        if params:
+            client.password = params[0]
+
+    def _on_nick(self, client, params):
+        if not params:
+            return client.numeric('431', 'No nickname given')
+        nick = params[0]
+        other = self.clients.get(nick.lower())
+        if other is not None and other is not client:
+            return client.numeric('433', nick, 'Nickname is already in use')
+        if client.nick:
+            self.clients.pop(client.nick.lower(), None)
+        client.nick = nick
+        self.clients[nick.lower()] = client
+        self._register(client)
+
+    def _on_user(self, client, params):
+        if params:
+            client.user = params[0]
+        self._register(client)
+
+    def _on_cap(self, client, params):
+        if not params:
+            return
+        sub = params[0].upper()
+        if sub == 'LS':
+            client.send(':{} CAP * LS :{}'.format(self.name, ' '.join(sorted(TWITCH_CAPS)) if self.twitch else ''))
+        elif sub == 'REQ':
+            wanted = ' '.join(params[1:]).lstrip(':').split()
+            supported = TWITCH_CAPS if self.twitch else set()
+            if all(cap in supported for cap in wanted):
+                client.caps.update(wanted)
+                client.send(':{} CAP * ACK :{}'.format(self.name, ' '.join(wanted)))
+            else:
+                client.send(':{} CAP * NAK :{}'.format(self.name, ' '.join(wanted)))
+
+    def _on_ping(self, client, params):
+        client.send(':{0} PONG {0} :{1}'.format(self.name, params[0] if params else ''))
+
+    def _on_pong(self, client, params):
+        if params and params[-1] == client.pending_pong:
+            client.pending_pong = None
+
+    def _on_join(self, client, params):
+        if not client.registered or not params:
+            return
+        for name in params[0].split(','):
+            if not name.startswith('#'):
+                client.numeric('403', name, 'No such channel')
+                continue
+            chan = self._channel(name)
+            if client.nick.lower() in chan.clients:
+                continue
+            chan.clients[client.nick.lower()] = client
+            client.channels.add(chan.name.lower())
+            self.stats['joins'] += 1
+            if client.ready_at is None:
+                client.ready_at = time.monotonic()
+            for other in chan.clients.values():
+                if other is client or not self.twitch or 'twitch.tv/membership' in other.caps:
+                    other.send(':{} JOIN {}'.format(client.prefix, chan.name))
+            if self.twitch and 'twitch.tv/commands' in client.caps:
+                client.send('@badge-info=;badges=;color=;display-name={0};emote-sets=0;mod=0;subscriber=0;user-type= :tmi.twitch.tv USERSTATE {1}'.format(client.nick, chan.name))
+                client.send('@emote-only=0;followers-only=-1;r9k=0;room-id=1;slow=0;subs-only=0 :tmi.twitch.tv ROOMSTATE {}'.format(chan.name))
+            if chan.topic and not self.twitch:
+                client.numeric('332', chan.name, chan.topic)
+            self._names(client, chan)
+
+    def _names(self, client, chan):
+        nicks = list(chan.clients[k].nick for k in chan.clients)
+        if not self.twitch or 'twitch.tv/membership' in client.caps:
+            nicks += chan.users
+        else:
+            nicks = [client.nick]
+        for i in range(0, len(nicks), self.names_per_line):
+            client.numeric('353', '=', chan.name, ' '.join(nicks[i:i + self.names_per_line]))
+        client.numeric('366', chan.name, 'End of /NAMES list.')
+
+    def _on_names(self, client, params):
+        for name in (params[0].split(',') if params else []):
+            chan = self.channels.get(name.lower())
+            if chan:
+                self._names(client, chan)
+
+    def _on_part(self, client, params):
+        for name in (params[0].split(',') if params else []):
+            chan = self.channels.get(name.lower())
+            if not chan or client.nick.lower() not in chan.clients:
+                client.numeric('442', name, "You're not on that channel")
+                continue
+            for other in chan.clients.values():
+                other.send(':{} PART {}'.format(client.prefix, chan.name))
+            del chan.clients[client.nick.lower()]
+            client.channels.discard(chan.name.lower())
+
+    def _on_quit(self, client, params):
+        client.send('ERROR :Closing Link: {} (Quit: {})'.format(client.nick, params[0] if params else ''))
+        self._quit(client, params[0] if params else 'Quit')
+        client.writer.close()
+
+    def _on_privmsg(self, client, params, command='PRIVMSG'):
+        if not client.registered:
+            return client.numeric('451', 'You have not registered')
+        if len(params) < 2:
+            return client.numeric('412', 'No text to send')
+        target, text = params[0], params[1]
+        client.received += 1
+        self.stats['received'] += 1
+        self.messages.append((client.nick, target, text))
+        if target.lower() == 'nickserv' and not self.twitch:
+            return self._nickserv(client, text)
+        if target.startswith('#'):
+            chan = self.channels.get(target.lower())
+            if not chan:
+                return client.numeric('403', target, 'No such channel')
+            for other in chan.clients.values():
+                if other is not client:
+                    other.send(':{} {} {} :{}'.format(client.prefix, command, chan.name, text))
+        else:
+            other = self.clients.get(target.lower())
+            if other:
+                other.send(':{} {} {} :{}'.format(client.prefix, command, other.nick, text))
+            elif not self.twitch:
+                client.numeric('401', target, 'No such nick/channel')
+
+    def _on_notice(self, client, params):
+        self._on_privmsg(client, params, command='NOTICE')
+
+    def _nickserv(self, client, text):
+        args = text.split()
+        source = ':NickServ!NickServ@services.'
+        if args and args[0].lower() == 'identify':
+            password = args[-1] if len(args) > 1 else ''
+            if self.nickserv_password is None or password == self.nickserv_password:
+                client.send('{} NOTICE {} :You are now identified for {}.'.format(source, client.nick, client.nick))
+            else:
+                client.send('{} NOTICE {} :Invalid password for {}.'.format(source, client.nick, client.nick))
+        else:
+            client.send('{} NOTICE {} :Unknown command.'.format(source, client.nick))
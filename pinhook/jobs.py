@@ -0,0 +1,187 @@
+import random
+import time
+
+from . import metrics
+from . import plugin
+from .log import logger
+
+
+class _ThreadCall:
+    # what WorkerPool.submit needs to run a job on the thread pool
+    kind = 'job'
+    executor = 'thread'
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.timeout = runner.job.timeout
+
+    def __str__(self):
+        return str(self.runner.job)
+
+    def run(self, bot):
+        start = time.perf_counter()
+        try:
+            return self.runner.job.run(bot)
+        except Exception:
+            self.runner.errors += 1
+            raise
+        finally:
+            self.runner.last_duration = time.perf_counter() - start
+
+
+class JobRunner:
+    # schedules one job for one bot. Times are wall clock so cron jobs line
+    # up with the local time, `due` is the slot the next run belongs to
+    def __init__(self, jobs, job):
+        self.jobs = jobs
+        self.job = job
+        self.runs = 0
+        self.errors = 0
+        self.missed = 0
+        self.overlapped = 0
+        # the pooled call of the last thread run, done once it ran, failed,
+        # or was cancelled before it started
+        self.future = None
+        self.stopped = False
+        self.last_run = None
+        self.last_duration = None
+        self.due = None
+        self.next_run = None
+
+    @property
+    def running(self):
+        # jobs run inline are over before fire() returns
+        return self.future is not None and not self.future.done()
+
+    def start(self, now):
+        self.due = self.job.next_after(now)
+        self._schedule(now)
+
+    def stop(self):
+        self.stopped = True
+
+    def _schedule(self, now):
+        self.next_run = self.due + random.uniform(0, self.job.jitter) if self.job.jitter else self.due
+        self.jobs.scheduler.execute_after(max(0, self.next_run - now), self.fire)
+
+    def _slots_since(self, due, now):
+        # slots that came and went while we were waiting on `due`
+        if self.job.cron is None:
+            return int((now - due) // self.job.seconds)
+        missed = 0
+        while missed < 1000:
+            due = self.job.cron.next(due)
+            if due > now:
+                break
+            missed += 1
+        return missed
+
+    def fire(self):
+        if self.stopped:
+            return
+        job = self.job
+        now = time.time()
+        following = job.next_after(self.due)
+        run = job.enabled
+        if following <= now:
+            missed = self._slots_since(self.due, now)
+            self.missed += missed
+            if job.missed == 'all':
+                self.due = following
+            else:
+                self.due = job.next_after(now)
+                if job.missed == 'skip':
+                    self.missed += 1
+                    run = False
+        else:
+            self.due = following
+        if run and self.running and not job.overlap:
+            self.overlapped += 1
+            run = False
+        if run:
+            self._run(now)
+        self._schedule(time.time())
+
+    def _run(self, now):
+        job = self.job
+        bot = self.jobs.bot
+        self.runs += 1
+        self.last_run = now
+        if job.executor == 'thread':
+            self.future = bot.workers.submit(_ThreadCall(self), bot, self.output) or None
+            return
+        start = time.perf_counter()
+        try:
+            if metrics.enabled:
+                output = metrics.call(job.kind, str(job), job.run, bot)
+            else:
+                output = job.run(bot)
+        except Exception:
+            self.errors += 1
+            logger.exception('issue with job %s', job)
+            return
+        finally:
+            self.last_duration = time.perf_counter() - start
+        self.output(output)
+
+    def output(self, output):
+        bot = self.jobs.bot
+        if not output or not bot.connection.is_connected():
+            return
+        for chan in self.job.channels or list(bot.channels):
+            bot.process_output(bot.connection, chan, output)
+
+    def summary(self):
+        next_in = max(0, self.next_run - time.time()) if self.next_run else 0
+        last = '{:.1f}ms'.format(self.last_duration * 1000) if self.last_duration is not None else 'n/a'
+        return '{}: {} runs, {} errors, {} missed, {} overlapped, last took {}, next in {:.0f}s{}'.format(
+            self.job, self.runs, self.errors, self.missed, self.overlapped, last, next_in,
+            '' if self.job.enabled else ' (disabled)'
+        )
+
+
+class Jobs:
+    # runs the registered plugin jobs for a bot on its reactor's scheduler,
+    # jobs added, replaced or removed by a reload are picked up by sync()
+    def __init__(self, bot):
+        self.bot = bot
+        self.scheduler = bot.reactor.scheduler
+        self.runners = {}
+        self.started = False
+
+    def __iter__(self):
+        return iter(list(self.runners.values()))
+
+    def __len__(self):
+        return len(self.runners)
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            self.sync()
+
+    def stop(self):
+        self.started = False
+        for runner in self.runners.values():
+            runner.stop()
+        self.runners.clear()
+
+    def sync(self):
+        if not self.started:
+            return
+        now = time.time()
+        for name, runner in list(self.runners.items()):
+            if plugin.jobs.get(name) is not runner.job:
+                runner.stop()
+                del self.runners[name]
+        for name, job in list(plugin.jobs.items()):
+            if name not in self.runners:
+                logger.debug('scheduling job %s', name)
+                runner = JobRunner(self, job)
+                # this runs in reactor handlers, one bad job mustn't take the bot down
+                try:
+                    runner.start(now)
+                except Exception:
+                    logger.exception('could not schedule job %s', name)
+                    continue
+                self.runners[name] = runner
@@ -1,14 +1,116 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
 
 logger = logging.getLogger('bot')
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+levels = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warn': logging.WARNING,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+# handlers that write somewhere, either attached to the logger directly or
+# fed by the queue listener
+handlers = []
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    # one json object per line
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the message is built here because args may change once the call
+        # returns, the exception is kept apart for the json formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _add_handler(handler):
+    handlers.append(handler)
+    if _listener:
+        _listener.handlers = tuple(handlers)
+    else:
+        logger.addHandler(handler)
+
+
+def set_log_file(filename, json_lines=False, max_bytes=0, backups=5, rotate=None):
+    # Set file logger, once per file so several bots can share it. Files are
+    # rotated at `max_bytes` or at the `rotate` interval ('midnight', 'h', ...)
+    path = os.path.abspath(filename)
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == path:
+            return handler
+    if max_bytes:
+        filehandler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups)
+    elif rotate:
+        filehandler = logging.handlers.TimedRotatingFileHandler(filename, when=rotate, backupCount=backups)
+    else:
+        filehandler = logging.FileHandler(filename)
+    filehandler.setFormatter(JSONFormatter() if json_lines else formatter)
+    _add_handler(filehandler)
+    return filehandler
+
+
+def start_queue():
+    # moves writing to a background thread, the logging call only puts the
+    # record on a queue
+    global _listener
+    if _listener:
+        return
+    for handler in handlers:
+        logger.removeHandler(handler)
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    logger.addHandler(_QueueHandler(records))
+    _listener.start()
+    atexit.register(stop_queue)
+
+
+def stop_queue():
+    # writes out whatever is still queued and goes back to logging directly
+    global _listener
+    if not _listener:
+        return
+    for handler in logger.handlers[:]:
+        if isinstance(handler, _QueueHandler):
+            logger.removeHandler(handler)
+    _listener.stop()
+    _listener = None
+    for handler in handlers:
+        logger.addHandler(handler)
+
+
+def set_level(level):
+    if level in levels:
+        logger.setLevel(levels[level])
+
+
 # Set console logger
 streamhandler = logging.StreamHandler()
 streamhandler.setFormatter(formatter)
-logger.addHandler(streamhandler)
-
-def set_log_file(filename):
-    # Set file logger
-    filehandler = logging.FileHandler(filename)
-    filehandler.setFormatter(formatter)
-    logger.addHandler(filehandler)
\ No newline at end of file
+_add_handler(streamhandler)
@@ -0,0 +1,165 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+from .log import logger
+
+# checked before any timing is done, so disabled metrics cost one lookup
+enabled = False
+timers = {}
+_servers = {}
+
+
+class Histogram:
+    # log-linear buckets in microseconds, like HdrHistogram: values below
+    # 2**precision are exact and every power of two above that is split
+    # into 2**(precision - 1) buckets, so a value is off by at most 1/64
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.half = 1 << (precision - 1)
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, us):
+        shift = max(0, us.bit_length() - self.precision)
+        return shift * self.half + (us >> shift)
+
+    def _value(self, index):
+        shift = max(0, index // self.half - 1)
+        return (index - shift * self.half + 1) << shift
+
+    def record(self, seconds):
+        index = self._index(int(seconds * 1000000))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        wanted = max(1, p / 100 * self.count)
+        seen = 0
+        for index, count in sorted(self.counts.items()):
+            seen += count
+            if seen >= wanted:
+                return min(self._value(index) / 1000000, self.max)
+        return self.max
+
+
+class Timer:
+    __slots__ = ('kind', 'name', 'errors', 'histogram')
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.errors = 0
+        self.histogram = Histogram()
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    def record(self, seconds, error=False):
+        self.histogram.record(seconds)
+        if error:
+            self.errors += 1
+
+    def summary(self):
+        h = self.histogram
+        return '{} {}: {} calls, {} errors, p50 {} p95 {} p99 {} max {}'.format(
+            self.kind, self.name, h.count, self.errors,
+            _ms(h.percentile(50)), _ms(h.percentile(95)), _ms(h.percentile(99)), _ms(h.max)
+        )
+
+
+def _ms(seconds):
+    return '{:.2f}ms'.format(seconds * 1000)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    timers.clear()
+
+def timer(kind, name):
+    key = (kind, name)
+    t = timers.get(key)
+    if t is None:
+        t = timers[key] = Timer(kind, name)
+    return t
+
+def record(kind, name, seconds, error=False):
+    timer(kind, name).record(seconds, error)
+
+def call(kind, name, func, *args):
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except Exception:
+        record(kind, name, time.perf_counter() - start, error=True)
+        raise
+    record(kind, name, time.perf_counter() - start)
+    return result
+
+def report(kind=None):
+    return [t.summary() for (k, _), t in sorted(timers.items()) if kind in (None, k)]
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus():
+    lines = [
+        '# HELP pinhook_duration_seconds time spent handling messages',
+        '# TYPE pinhook_duration_seconds summary',
+    ]
+    errors = []
+    for (kind, name), t in sorted(timers.items()):
+        labels = 'kind="{}",name="{}"'.format(_label(kind), _label(name))
+        for q in (0.5, 0.95, 0.99):
+            lines.append('pinhook_duration_seconds{{{},quantile="{}"}} {}'.format(labels, q, t.histogram.percentile(q * 100)))
+        lines.append('pinhook_duration_seconds_count{{{}}} {}'.format(labels, t.count))
+        lines.append('pinhook_duration_seconds_sum{{{}}} {}'.format(labels, t.histogram.total))
+        errors.append('pinhook_errors_total{{{}}} {}'.format(labels, t.errors))
+    lines.append('# HELP pinhook_errors_total calls that raised or timed out')
+    lines.append('# TYPE pinhook_errors_total counter')
+    return '\n'.join(lines + errors) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('metrics request: ' + format, *args)
+
+
+def serve(port, host='127.0.0.1'):
+    # serves /metrics in the Prometheus text format from a daemon thread,
+    # once per address so several bots can ask for the same port
+    if (host, port) in _servers:
+        return _servers[(host, port)]
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='pinhook-metrics', daemon=True)
+    thread.start()
+    _servers[(host, port)] = server
+    logger.info('serving metrics on http://%s:%s/metrics', host, port)
+    return server
@@ -0,0 +1,60 @@
+def size(text):
+    # encoded length without encoding when the text is plain ascii
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8'))
+
+
+def split_line(text, budget):
+    # splits text into chunks of at most `budget` utf-8 bytes, preferring
+    # to break at spaces and never inside a character
+    budget = max(budget, 4)
+    if len(text) * 4 <= budget:
+        return [text]
+    data = text.encode('utf-8')
+    if len(data) <= budget:
+        return [text]
+    chunks = []
+    while len(data) > budget:
+        cut = budget
+        # data[cut] starts the next chunk, so it must not be a continuation byte
+        while cut > 0 and data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        space = data.rfind(b' ', 0, cut + 1)
+        if space > 0:
+            chunks.append(data[:space])
+            data = data[space + 1:]
+        else:
+            chunks.append(data[:cut])
+            data = data[cut:]
+    if data:
+        chunks.append(data)
+    return [c.decode('utf-8') for c in chunks]
+
+
+def fit_lines(lines, budget, join=None):
+    # splits lines that are too long, and when `join` is given also puts
+    # consecutive short lines together, separated by it, while they fit.
+    # Empty lines can't be sent and are skipped
+    out = []
+    current = None
+    current_size = 0
+    join_size = size(join) if join else 0
+    for line in lines:
+        for chunk in split_line(line, budget):
+            if not chunk:
+                continue
+            if not join:
+                out.append(chunk)
+                continue
+            chunk_size = size(chunk)
+            if current is not None and current_size + join_size + chunk_size <= budget:
+                current = current + join + chunk
+                current_size += join_size + chunk_size
+            else:
+                if current is not None:
+                    out.append(current)
+                current, current_size = chunk, chunk_size
+    if current is not None:
+        out.append(current)
+    return out
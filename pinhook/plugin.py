@@ -1,13 +1,36 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from functools import wraps
-import importlib
+import ast
+import hashlib
+import importlib.util
+import inspect
 import os
+import re
+import sys
+import threading
+import time
 
+from . import metrics
+from .cron import Cron
 from .log import logger
+from .store import default_store
 
 plugins = {}
 cmds = {}
 lstnrs = {}
+jobs = {}
+modules = {}
+import_times = {}
+_local = threading.local()
+_listener_index = None
+# bumped whenever commands or listeners change so bots know to rebuild
+# their dispatch tables
+generation = 0
+# keywords made of words and single spaces are looked up in a dict
+_word = re.compile(r'\w+')
+_word_phrase = re.compile(r'\w+(?: \w+)*')
 
 class OutputType(Enum):
     Message = 'message'
@@ -15,9 +38,10 @@ class OutputType(Enum):
 
 
 class Output:
-    def __init__(self, msg_type, msg):
+    def __init__(self, msg_type, msg, join=None):
         self.msg_type = msg_type
         self.msg = self.sanitize(msg)
+        self.join = join
 
     def sanitize(self, msg):
         try:
@@ -26,9 +50,56 @@ class Output:
             return msg
 
 
+class ResponseCache:
+    # LRU of outputs for a command, keyed by its normalized argument and
+    # optionally the channel. Entries expire after `ttl` seconds
+    def __init__(self, ttl, size=128, per_channel=False):
+        self.ttl = ttl
+        self.size = size
+        self.per_channel = per_channel
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, msg):
+        arg = ' '.join((msg.arg or '').split())
+        if self.per_channel:
+            return (msg.channel.lower(), arg)
+        return arg
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, output):
+        self.entries[key] = (time.monotonic() + self.ttl, output)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+
 class _BasePlugin:
     enabled = True
     logger = logger
+    executor = None
+    timeout = None
+    cache = None
+    kind = 'plugin'
 
     def enable(self):
         self.enabled = True
@@ -36,12 +107,30 @@ class _BasePlugin:
     def disable(self):
         self.enabled = False
 
+    def resolve(self):
+        return self
+
+    @property
+    def stats(self):
+        # call count, errors and latency histogram, kept while metrics are enabled
+        return metrics.timers.get((self.kind, str(self)))
+
 
 class Listener(_BasePlugin):
-    def __init__(self, name, run=None):
+    kind = 'listener'
+
+    def __init__(self, name, run=None, executor=None, timeout=None, **kwargs):
         self.name = name
         if run:
             self.run = run
+        self.executor = executor
+        self.timeout = timeout
+        self.regex = kwargs.get('regex', None)
+        if isinstance(self.regex, str):
+            self.regex = re.compile(self.regex)
+        self.keywords = {k.lower() for k in kwargs.get('keywords', None) or ()}
+        self.channels = {c.lower() for c in kwargs.get('channels', None) or ()}
+        self.msg_types = set(kwargs.get('msg_types', None) or ())
         self._add_listener()
 
     def __str__(self):
@@ -51,11 +140,88 @@ class Listener(_BasePlugin):
         pass
 
     def _add_listener(self):
-        lstnrs[self.name] = self
-        plugins[self.name] = self
+        global _listener_index, generation
+        registry = _registry()[1]
+        registry[self.name] = self
+        if registry is lstnrs:
+            plugins[self.name] = self
+            _listener_index = None
+            generation += 1
+
+
+class _ListenerIndex:
+    # listeners that declare a regex or keywords are only looked at when the
+    # combined pattern for all of them finds something in the text
+    def __init__(self, listeners):
+        self.order = {l.name: i for i, l in enumerate(listeners)}
+        self.always = []
+        self.by_keyword = {}
+        self.regex_listeners = []
+        for l in listeners:
+            if l.regex:
+                self.regex_listeners.append(l)
+            for k in l.keywords:
+                self.by_keyword.setdefault(k, []).append(l)
+            if not (l.regex or l.keywords):
+                self.always.append(l)
+        self.word_keywords = {}
+        self.keyword_pattern = None
+        self.keyword_patterns = []
+        others = {}
+        for k, listeners in self.by_keyword.items():
+            if _word_phrase.fullmatch(k):
+                self.word_keywords[k] = listeners
+            else:
+                others[k] = listeners
+        # a phrase of n words is found among the text's runs of n words
+        self.phrase_sizes = sorted({k.count(' ') + 1 for k in self.word_keywords})
+        if others:
+            # lookarounds instead of \b, which never matches next to the
+            # punctuation of keywords like 'c++' or ':)'
+            bounded = {w: r'(?<!\w){}(?!\w)'.format(re.escape(w)) for w in others}
+            self.keyword_pattern = re.compile('|'.join(bounded.values()), re.IGNORECASE)
+            self.keyword_patterns = [(re.compile(b, re.IGNORECASE), others[w]) for w, b in bounded.items()]
+        self.regex_pattern = None
+        if self.regex_listeners and len({l.regex.flags for l in self.regex_listeners}) == 1:
+            try:
+                self.regex_pattern = re.compile(
+                    '|'.join('(?:{})'.format(l.regex.pattern) for l in self.regex_listeners),
+                    self.regex_listeners[0].regex.flags
+                )
+            except re.error:
+                # backreferences or repeated group names, test one by one
+                self.regex_pattern = None
+
+    def match(self, text, channel, msg_type):
+        found = set(self.always)
+        if self.word_keywords:
+            lower = text.lower()
+            spans = [m.span() for m in _word.finditer(lower)]
+            for n in self.phrase_sizes:
+                for i in range(len(spans) - n + 1):
+                    # only equal to a phrase when its words are one space apart
+                    listeners = self.word_keywords.get(lower[spans[i][0]:spans[i + n - 1][1]])
+                    if listeners:
+                        found.update(listeners)
+        if self.keyword_pattern and self.keyword_pattern.search(text):
+            # matches of one pattern can't overlap, so every keyword with
+            # punctuation is checked once any of them is there
+            for pattern, listeners in self.keyword_patterns:
+                if pattern.search(text):
+                    found.update(listeners)
+        if self.regex_listeners and (self.regex_pattern is None or self.regex_pattern.search(text)):
+            found.update(l for l in self.regex_listeners if l.regex.search(text))
+        channel = channel.lower()
+        found = [l for l in found
+                 if not (l.channels and channel not in l.channels)
+                 and not (l.msg_types and msg_type not in l.msg_types)]
+        found.sort(key=lambda l: self.order[l.name])
+        return found
 
 
 class Command(_BasePlugin):
+    kind = 'command'
+
     def __init__(self, cmd, **kwargs):
         self.cmd = cmd
         self.help_text = kwargs.get('help_text', 'N/A')
@@ -63,6 +229,11 @@ class Command(_BasePlugin):
         self.ops_msg = kwargs.get('ops_msg', '')
         self.hide = kwargs.get('hide', False)
         self.run = kwargs.get('run', self.run)
+        self.executor = kwargs.get('executor', None)
+        self.timeout = kwargs.get('timeout', None)
+        self.aliases = list(kwargs.get('aliases', None) or [])
+        self.cost = kwargs.get('cost', 1)
+        self._set_cache(kwargs)
         self._add_command()
 
     def __str__(self):
@@ -72,84 +243,418 @@ class Command(_BasePlugin):
         pass
 
     def _enable_ops(self, ops_msg):
+        global generation
         self.ops = True
         self.ops_msg = ops_msg
+        generation += 1
 
     def _update_plugin(self, **kwargs):
         self.help_text = kwargs.get('help_text', 'N/A')
         self.run = kwargs.get('run', self.run)
+        self.executor = kwargs.get('executor', self.executor)
+        self.timeout = kwargs.get('timeout', self.timeout)
+        self.aliases = list(kwargs.get('aliases', None) or self.aliases)
+        self.cost = kwargs.get('cost', self.cost)
+        self._set_cache(kwargs)
+
+    def _set_cache(self, kwargs):
+        # a new function means old responses may be wrong, start over
+        ttl = kwargs.get('cache_ttl', None)
+        if ttl:
+            self.cache = ResponseCache(ttl, kwargs.get('cache_size', None) or 128, kwargs.get('cache_per_channel', False))
+        else:
+            self.cache = None
 
     def _add_command(self):
-        cmds[self.cmd] = self
-        plugins[self.cmd] = self
+        global generation
+        registry = _registry()[0]
+        registry[self.cmd] = self
+        if registry is cmds:
+            plugins[self.cmd] = self
+            generation += 1
+
+
+class Job(_BasePlugin):
+    kind = 'job'
+    missed_policies = ('once', 'skip', 'all')
+
+    def __init__(self, name, run=None, seconds=None, cron=None, jitter=0, executor=None, timeout=None, overlap=False, missed='once', channels=None):
+        if (seconds is None) == (cron is None):
+            raise ValueError('job {} needs either seconds or a cron expression'.format(name))
+        if seconds is not None and seconds <= 0:
+            raise ValueError('job {} needs a positive interval'.format(name))
+        if executor not in (None, 'thread'):
+            raise ValueError("job {} can only use executor='thread'".format(name))
+        if missed not in self.missed_policies:
+            raise ValueError('job {} has unknown missed policy {!r}'.format(name, missed))
+        self.name = name
+        if run:
+            self.run = run
+        self.seconds = seconds
+        self.cron = Cron(cron) if isinstance(cron, str) else cron
+        self.jitter = jitter
+        self.executor = executor
+        self.timeout = timeout
+        self.overlap = overlap
+        self.missed = missed
+        self.channels = list(channels or [])
+        self._add_job()
+
+    def __str__(self):
+        return self.name
+
+    def run(self, bot):
+        pass
+
+    def next_after(self, when):
+        if self.cron:
+            return self.cron.next(when)
+        return when + self.seconds
+
+    def _add_job(self):
+        global generation
+        registry = _registry()[2]
+        registry[self.name] = self
+        if registry is jobs:
+            plugins[self.name] = self
+            generation += 1
+
 
+class _PluginModule:
+    def __init__(self, name, path, mtime=None, digest=None):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.digest = digest
+        self.prefix = ''
+        self.module = None
+        self.lazy = False
+        self.cmds = {}
+        self.lstnrs = {}
+        self.jobs = {}
+
+
+class _LazyCommand(Command):
+    # stand-in registered from a pre-scan of the plugin file, the module is
+    # only imported the first time the command is used
+    def __init__(self, module_name, cmd, **kwargs):
+        self.module_name = module_name
+        super().__init__(cmd, **kwargs)
+
+    def resolve(self):
+        if not _realize(self.module_name):
+            return None
+        return modules[self.module_name].cmds.get(self.cmd)
+
+    def run(self, msg):
+        real = self.resolve()
+        if real:
+            return real.run(msg)
 
-def action(msg):
-    return Output(OutputType.Action, msg)
 
-def message(msg):
-    return Output(OutputType.Message, msg)
+class _LazyListener(Listener):
+    def __init__(self, module_name, name, **kwargs):
+        self.module_name = module_name
+        super().__init__(name, **kwargs)
 
-def _add_command(command, help_text, func,  ops=False, ops_msg='', hide=False):
-    if command not in cmds:
-        Command(command, help_text=help_text, ops=ops, ops_msg=ops_msg, hide=hide, run=func)
+    def resolve(self):
+        if not _realize(self.module_name):
+            return None
+        return modules[self.module_name].lstnrs.get(self.name)
+
+    def run(self, msg):
+        real = self.resolve()
+        if real:
+            return real.run(msg)
+
+
+def _registry():
+    # while a plugin file is imported its commands and listeners are collected
+    # on the side, and only swapped in once the whole file loaded
+    staged = getattr(_local, 'module', None)
+    if staged is not None:
+        return staged.cmds, staged.lstnrs, staged.jobs
+    return cmds, lstnrs, jobs
+
+
+def store(name=None):
+    # persistent key-value state, namespaced by the calling plugin file
+    if name is None:
+        name = sys._getframe(1).f_globals.get('__name__', 'default')
+    return default_store().namespace(name)
+
+def action(msg, join=None):
+    return Output(OutputType.Action, msg, join)
+
+def message(msg, join=None):
+    return Output(OutputType.Message, msg, join)
+
+def _add_command(command, help_text, func,  ops=False, ops_msg='', hide=False, executor=None, timeout=None, aliases=None, cost=1, cache_ttl=None, cache_size=None, cache_per_channel=False):
+    global generation
+    registry = _registry()[0]
+    cache = {'cache_ttl': cache_ttl, 'cache_size': cache_size, 'cache_per_channel': cache_per_channel}
+    if command not in registry:
+        Command(command, help_text=help_text, ops=ops, ops_msg=ops_msg, hide=hide, run=func, executor=executor, timeout=timeout, aliases=aliases, cost=cost, **cache)
     else:
-        cmds[command]._update_plugin(help_text=help_text, run=func)
+        registry[command]._update_plugin(help_text=help_text, run=func, executor=executor, timeout=timeout, aliases=aliases, cost=cost, **cache)
+        generation += 1
 
 def _ops_plugin(command, ops_msg, func):
-    if command not in cmds:
+    registry = _registry()[0]
+    if command not in registry:
         Command(command, ops=True, ops_msg=ops_msg)
     else:
-        cmds[command]._enable_ops(ops_msg)
+        registry[command]._enable_ops(ops_msg)
 
-def _add_listener(name, func):
-    Listener(name, run=func)
+def _add_listener(name, func, executor=None, timeout=None, **kwargs):
+    Listener(name, run=func, executor=executor, timeout=timeout, **kwargs)
+
+def _add_job(name, func, **kwargs):
+    Job(name, run=func, **kwargs)
+
+def match_listeners(text, channel, msg_type):
+    global _listener_index
+    if _listener_index is None:
+        _listener_index = _ListenerIndex(list(lstnrs.values()))
+    return _listener_index.match(text, channel, msg_type)
 
 def clear_plugins():
+    global _listener_index, generation
     cmds.clear()
     lstnrs.clear()
-
-def load_plugins(plugin_dir, use_prefix=False, cmd_prefix='!'):
-    # i'm not sure why i need this but i do
-    global cmds
-    global plugins
-    global lstnrs
+    jobs.clear()
+    _listener_index = None
+    generation += 1
+
+def _import_plugin(staged):
+    spec = importlib.util.spec_from_file_location(staged.name, staged.path)
+    module = importlib.util.module_from_spec(spec)
+    previous = sys.modules.get(staged.name)
+    sys.modules[staged.name] = module
+    _local.module = staged
+    start = time.perf_counter()
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        if previous is not None:
+            sys.modules[staged.name] = previous
+        else:
+            sys.modules.pop(staged.name, None)
+        raise
+    finally:
+        _local.module = None
+    import_times[staged.name] = time.perf_counter() - start
+    logger.info('imported plugin %s in %.3fs', staged.name, import_times[staged.name])
+    staged.module = module
+
+def _call_name(func):
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+
+def _scan_plugin(path):
+    # find @command/@listener decorators whose arguments are all literals,
+    # any other way of registering means the file has to be imported
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    decorators = {'command': command, 'listener': listener}
+    found = []
+    seen = set()
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for dec in node.decorator_list:
+            if not (isinstance(dec, ast.Call) and _call_name(dec.func) in decorators):
+                continue
+            if any(k.arg is None for k in dec.keywords):
+                return None
+            try:
+                args = [ast.literal_eval(a) for a in dec.args]
+                kwargs = {k.arg: ast.literal_eval(k.value) for k in dec.keywords}
+                bound = inspect.signature(decorators[_call_name(dec.func)]).bind(*args, **kwargs)
+            except (ValueError, TypeError, SyntaxError):
+                return None
+            bound.apply_defaults()
+            found.append((_call_name(dec.func), bound.arguments))
+            seen.add(dec)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and node not in seen and _call_name(node.func) in _registration_names:
+            return None
+    return found or None
+
+def _stage_lazy(staged, found):
+    _local.module = staged
+    try:
+        for kind, params in found:
+            if kind == 'command':
+                params = dict(params, hide=False)
+                _LazyCommand(staged.name, params.pop('command'), **params)
+            else:
+                _LazyListener(staged.name, params.pop('name'), **params)
+    finally:
+        _local.module = None
+    staged.lazy = True
+
+def _realize(name):
+    global _listener_index
+    global generation
+    staged = modules.get(name)
+    if staged is None:
+        return False
+    if not staged.lazy:
+        return True
+    real = _PluginModule(name, staged.path, staged.mtime, staged.digest)
+    disabled_plugins = [n for n, p in list(staged.cmds.items()) + list(staged.lstnrs.items()) if not p.enabled]
+    _uninstall(staged)
+    try:
+        logger.info('loading plugin %s on first use', name)
+        _import_plugin(real)
+    except Exception:
+        logger.exception('could not load plugin')
+        real.cmds.clear()
+        real.lstnrs.clear()
+        real.jobs.clear()
+    _install(real, staged.prefix, disabled_plugins)
+    modules[name] = real
+    _listener_index = None
+    generation += 1
+    return bool(real.module)
+
+def _install(staged, prefix, disabled_plugins):
+    staged.prefix = prefix
+    for name, c in staged.cmds.items():
+        cmds[prefix + name] = c
+        plugins[name] = c
+    for name, l in staged.lstnrs.items():
+        lstnrs[name] = l
+        plugins[name] = l
+    for name, j in staged.jobs.items():
+        jobs[name] = j
+        plugins[name] = j
+    for name in list(staged.cmds) + list(staged.lstnrs) + list(staged.jobs):
+        if name in disabled_plugins:
+            plugins[name].disable()
+
+def _uninstall(staged):
+    for name in staged.cmds:
+        cmds.pop(staged.prefix + name, None)
+        plugins.pop(name, None)
+    for name in staged.lstnrs:
+        lstnrs.pop(name, None)
+        plugins.pop(name, None)
+    for name in staged.jobs:
+        jobs.pop(name, None)
+        plugins.pop(name, None)
+
+_registration_names = {'command', 'listener', 'register', 'ops', 'every', 'at', 'Command', 'Listener', 'Job',
+                       '_add_command', '_add_listener', '_add_job', '_ops_plugin'}
+
+def load_plugins(plugin_dir, use_prefix=False, cmd_prefix='!', incremental=False, lazy=False, parallel=0):
+    global _listener_index
+    global generation
     #check for all the disabled plugins so that we don't re-enable them
     disabled_plugins = [i for i in plugins if not plugins[i].enabled]
     logger.debug(disabled_plugins)
-    # clear plugin list to ensure no old plugins remain
-    logger.info('clearing plugin cache')
-    clear_plugins()
+    if not incremental:
+        # clear plugin list to ensure no old plugins remain
+        logger.info('clearing plugin cache')
+        clear_plugins()
+        plugins.clear()
+        modules.clear()
     # ensure plugin folder exists
     logger.info('checking plugin directory')
     if not os.path.exists(plugin_dir):
-        logger.info('plugin directory {} not found, creating'.format(plugin_dir))
+        logger.info('plugin directory %s not found, creating', plugin_dir)
         os.makedirs(plugin_dir)
-    # load all plugins
-    for m in os.listdir(plugin_dir):
-        if m.endswith('.py'):
-            try:
-                name = m[:-3]
-                logger.info('loading plugin {}'.format(name))
-                spec = importlib.machinery.PathFinder().find_spec(name, [plugin_dir])
-                spec.loader.load_module()
-            except Exception:
-                logger.exception('could not load plugin')
-    # gather all commands and listeners
-    if use_prefix: # use prefixes if needed
-        cmds = {cmd_prefix + k: v for k,v in cmds.items()}
-    for p in plugins:
-        if p in disabled_plugins:
-            plugins[p].disable()
+    found = {m[:-3]: os.path.join(plugin_dir, m) for m in sorted(os.listdir(plugin_dir)) if m.endswith('.py')}
+    changed = []
+    for name in [n for n in modules if n not in found]:
+        logger.info('unloading plugin %s', name)
+        _uninstall(modules.pop(name))
+        sys.modules.pop(name, None)
+        changed.append(name)
+    # find new and changed plugins, unchanged files keep their module and state
+    pending = []
+    for name, path in found.items():
+        old = modules.get(name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if old and old.mtime == mtime:
+                continue
+            with open(path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            logger.exception('could not read plugin %s', name)
+            continue
+        if old and old.digest == digest:
+            old.mtime = mtime
+            continue
+        staged = _PluginModule(name, path, mtime, digest)
+        scanned = _scan_plugin(path) if lazy else None
+        if scanned:
+            logger.info('registered plugin %s for loading on first use', name)
+            _stage_lazy(staged, scanned)
+        pending.append(staged)
+    to_import = [p for p in pending if not p.lazy]
+    errors = {}
+    def try_import(staged):
+        try:
+            logger.info('loading plugin %s', staged.name)
+            _import_plugin(staged)
+        except Exception as e:
+            errors[staged.name] = e
+    start = time.perf_counter()
+    if parallel > 1 and len(to_import) > 1:
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='pinhook-import') as pool:
+            list(pool.map(try_import, to_import))
+    else:
+        for staged in to_import:
+            try_import(staged)
+    if to_import:
+        slowest = sorted(to_import, key=lambda p: import_times.get(p.name, 0), reverse=True)[:3]
+        logger.info(
+            'imported %s plugins in %.3fs, slowest: %s',
+            len(to_import),
+            time.perf_counter() - start,
+            ', '.join('{} ({:.3f}s)'.format(p.name, import_times.get(p.name, 0)) for p in slowest)
+        )
+    for staged in pending:
+        old = modules.get(staged.name)
+        if staged.name in errors:
+            logger.error('could not load plugin', exc_info=errors[staged.name])
+            # keep whatever was loaded before and don't retry until the file changes again
+            if old:
+                old.mtime, old.digest = staged.mtime, staged.digest
+            else:
+                staged.cmds.clear()
+                staged.lstnrs.clear()
+                staged.jobs.clear()
+                modules[staged.name] = staged
+            continue
+        if old:
+            _uninstall(old)
+        _install(staged, cmd_prefix if use_prefix else '', disabled_plugins)
+        modules[staged.name] = staged
+        changed.append(staged.name)
     for cmd in cmds:
-        logger.debug('adding command {}'.format(cmd))
+        logger.debug('adding command %s', cmd)
     for lstnr in lstnrs:
-        logger.debug('adding listener {}'.format(lstnr))
-
-def command(command, help_text='N/A', ops=False, ops_msg='', hide=False):
+        logger.debug('adding listener %s', lstnr)
+    for job in jobs:
+        logger.debug('adding job %s', job)
+    _listener_index = None
+    generation += 1
+    return changed
+
+def command(command, help_text='N/A', ops=False, ops_msg='', hide=False, executor=None, timeout=None, aliases=None, cost=1, cache_ttl=None, cache_size=None, cache_per_channel=False):
     @wraps(command)
     def register_for_command(func):
-        _add_command(command, help_text, func, ops=ops, ops_msg=ops_msg, hide=False)
+        _add_command(command, help_text, func, ops=ops, ops_msg=ops_msg, hide=False, executor=executor, timeout=timeout, aliases=aliases, cost=cost,
+                     cache_ttl=cache_ttl, cache_size=cache_size, cache_per_channel=cache_per_channel)
         return func
     return register_for_command
 
@@ -161,12 +666,27 @@ def register(command, help_text='N/A'):
         return func
     return register_for_command
 
-def listener(name):
+def listener(name, executor=None, timeout=None, regex=None, keywords=None, channels=None, msg_types=None):
     def register_as_listener(func):
-        _add_listener(name, func)
+        _add_listener(name, func, executor=executor, timeout=timeout, regex=regex,
+                      keywords=keywords, channels=channels, msg_types=msg_types)
         return func
     return register_as_listener
 
+def every(seconds, name=None, jitter=0, executor=None, timeout=None, overlap=False, missed='once', channels=None):
+    def register_as_job(func):
+        _add_job(name or func.__name__, func, seconds=seconds, jitter=jitter, executor=executor,
+                 timeout=timeout, overlap=overlap, missed=missed, channels=channels)
+        return func
+    return register_as_job
+
+def at(cron, name=None, jitter=0, executor=None, timeout=None, overlap=False, missed='once', channels=None):
+    def register_as_job(func):
+        _add_job(name or func.__name__, func, cron=cron, jitter=jitter, executor=executor,
+                 timeout=timeout, overlap=overlap, missed=missed, channels=channels)
+        return func
+    return register_as_job
+
 def ops(command, msg=None):
     logger.warn('use of the @ops decorator has been deprecated in favor of using the @command decorator with the ops and ops_msg options. Use will cause errors in future versions.')
     @wraps(command)
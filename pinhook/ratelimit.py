@@ -0,0 +1,135 @@
+from collections import OrderedDict, deque
+import contextlib
+import time
+
+import irc.client
+
+from . import metrics
+from .log import logger
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, cost=1):
+        if self.rate <= 0:
+            return True
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def available(self):
+        if self.rate <= 0:
+            return float('inf')
+        self._refill(time.monotonic())
+        return self.tokens
+
+    def delay(self, cost=1):
+        # seconds until `cost` tokens will be available
+        if self.rate <= 0:
+            return 0
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class SendQueue:
+    def __init__(self, scheduler, rate=2, burst=4):
+        self.scheduler = scheduler
+        self.bucket = TokenBucket(rate, burst)
+        self.queue = deque()
+        self._scheduled = False
+        # the bot sets this to its transport's batch(), so everything sent
+        # in one drain goes out in a single write
+        self.batch = contextlib.nullcontext
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, func, *args):
+        self.queue.append((func, args, time.perf_counter() if metrics.enabled else None))
+        if not self._scheduled:
+            self.drain()
+
+    def clear(self):
+        self.queue.clear()
+
+    def drain(self):
+        # runs on the reactor thread, either directly from put() or from the
+        # reactor's scheduler once the bucket has refilled
+        self._scheduled = False
+        with self.batch():
+            while self.queue:
+                if not self.bucket.consume():
+                    self._scheduled = True
+                    self.scheduler.execute_after(self.bucket.delay(), self.drain)
+                    return
+                func, args, queued = self.queue.popleft()
+                try:
+                    if queued is None:
+                        func(*args)
+                    else:
+                        start = time.perf_counter()
+                        func(*args)
+                        metrics.record('reactor', 'send', time.perf_counter() - start)
+                        metrics.record('reactor', 'queue_wait', start - queued)
+                except irc.client.MessageTooLong:
+                    logger.error('output message too long: %s', args[-1])
+                except irc.client.ServerNotConnectedError:
+                    logger.error('not connected, dropping %s queued messages', len(self.queue) + 1)
+                    self.queue.clear()
+
+
+class Throttle:
+    # token buckets per nick, per hostmask and per channel, a line is only
+    # let through when every bucket it falls in has enough tokens
+    def __init__(self, limits, max_keys=10000):
+        # limits maps a kind to (rate, burst), a rate of 0 turns it off
+        self.limits = {k: v for k, v in limits.items() if v and v[0] > 0}
+        self.max_keys = max_keys
+        self.buckets = {k: OrderedDict() for k in self.limits}
+        self.counters = {'allowed': 0, 'dropped': 0}
+        for kind in self.limits:
+            self.counters['dropped_' + kind] = 0
+
+    def __bool__(self):
+        return bool(self.limits)
+
+    def _bucket(self, kind, key):
+        buckets = self.buckets[kind]
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*self.limits[kind])
+            # forgetting the least recently seen bucket only ever hands
+            # out a fresh burst
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, nick, host, channel, cost=1):
+        keys = {'nick': nick, 'host': host, 'channel': channel}
+        buckets = []
+        for kind in self.limits:
+            bucket = self._bucket(kind, keys[kind])
+            if bucket.available() < cost:
+                self.counters['dropped'] += 1
+                self.counters['dropped_' + kind] += 1
+                return False
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.tokens -= cost
+        self.counters['allowed'] += 1
+        return True
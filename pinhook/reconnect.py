@@ -0,0 +1,91 @@
+import random
+
+import irc.bot
+
+
+class Backoff(irc.bot.ReconnectStrategy):
+    # exponential backoff with jitter: attempt n waits a random time between
+    # min_interval and min_interval * 2**n, capped at max_interval, so bots
+    # dropped by the same netsplit don't all come back in the same second.
+    # The count starts over once the bot is registered again
+    def __init__(self, min_interval=1, max_interval=300, jitter=True):
+        if not 0 <= min_interval <= max_interval:
+            raise ValueError('reconnect_min must be between 0 and reconnect_max')
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.attempts = 0
+        self.bot = None
+        self._check_scheduled = False
+
+    def delay(self):
+        ceiling = min(self.max_interval, self.min_interval * 2 ** min(self.attempts, 32))
+        if self.jitter:
+            return random.uniform(self.min_interval, ceiling)
+        return ceiling
+
+    def run(self, bot):
+        self.bot = bot
+        if self._check_scheduled:
+            return
+        delay = self.delay()
+        self.attempts += 1
+        bot.logger.debug('reconnect attempt %s in %.1fs', self.attempts, delay)
+        bot.reactor.scheduler.execute_after(delay, self.check)
+        self._check_scheduled = True
+
+    def check(self):
+        self._check_scheduled = False
+        if not self.bot.connection.is_connected():
+            self.bot.logger.info('reconnecting, attempt %s', self.attempts)
+            # schedules the next check first, in case this attempt fails too
+            self.run(self.bot)
+            self.bot.jump_server()
+
+    def reset(self):
+        self.attempts = 0
+
+
+def join_lines(channels, limit=512, targets=None):
+    # as few JOIN lines as it takes to join `channels` ('#chan' or '#chan key'),
+    # each at most `limit` bytes with '\r\n' and at most `targets` channels.
+    # Channels with keys go first, keys are matched to channels by position
+    keyed = []
+    unkeyed = []
+    for channel in channels:
+        parts = channel.split()
+        if len(parts) > 1:
+            keyed.append((parts[0], parts[1]))
+        elif parts:
+            unkeyed.append((parts[0], None))
+    lines = []
+    names = []
+    keys = []
+    size = 0
+    for name, key in keyed + unkeyed:
+        # a comma before every channel but the first, a comma or space
+        # before every key
+        added = len(name.encode('utf-8')) + bool(names)
+        if key is not None:
+            added += len(key.encode('utf-8')) + 1
+        full = names and (size + added > limit or (targets and len(names) >= targets))
+        if full:
+            lines.append(_join_line(names, keys))
+            names = []
+            keys = []
+            added -= 1
+        if not names:
+            size = len('JOIN \r\n')
+        names.append(name)
+        if key is not None:
+            keys.append(key)
+        size += added
+    if names:
+        lines.append(_join_line(names, keys))
+    return lines
+
+
+def _join_line(names, keys):
+    if keys:
+        return 'JOIN {} {}'.format(','.join(names), ','.join(keys))
+    return 'JOIN {}'.format(','.join(names))
@@ -0,0 +1,177 @@
+from collections.abc import Mapping, Set
+import sys
+
+import irc.modes
+
+# rfc1459 casemapping, the same as irc.strings
+_FOLD = str.maketrans('[]\\^', '{}|~')
+
+
+def fold(name):
+    return name.lower().translate(_FOLD)
+
+
+class Channel(Set):
+    # read-only view of the nicks in one channel. Membership ignores case and
+    # nothing is copied until the view is iterated
+    __slots__ = ('name', '_roster', '_keys', '_modes')
+
+    def __init__(self, roster, name):
+        self.name = name
+        self._roster = roster
+        self._keys = set()
+        self._modes = {}
+
+    def __contains__(self, nick):
+        return isinstance(nick, str) and fold(nick) in self._keys
+
+    def __iter__(self):
+        # iterates over a snapshot so plugins on worker threads can't see
+        # the set change size underneath them
+        names = self._roster.names
+        return (names[key] for key in list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '<Channel {} with {} users>'.format(self.name, len(self._keys))
+
+    # the parts of irc.bot.Channel plugins are likely to use
+    def users(self):
+        return self
+
+    def has_user(self, nick):
+        return nick in self
+
+    def opers(self):
+        return self._with_mode('o')
+
+    def voiced(self):
+        return self._with_mode('v')
+
+    def is_oper(self, nick):
+        return fold(nick) in self._modes.get('o', ())
+
+    def is_voiced(self, nick):
+        return fold(nick) in self._modes.get('v', ())
+
+    def _with_mode(self, mode):
+        names = self._roster.names
+        return [names[key] for key in list(self._modes.get(mode, ()))]
+
+
+class Roster(Mapping):
+    # users of every channel the bot is in, kept up to date from JOIN, PART,
+    # KICK, QUIT, NICK, MODE and NAMES. Nicks are interned and stored once
+    # in `names`, channels only hold references to their folded form
+    def __init__(self):
+        self.channels = {}
+        self.names = {}
+
+    def __getitem__(self, channel):
+        return self.channels[fold(channel)]
+
+    def __contains__(self, channel):
+        return isinstance(channel, str) and fold(channel) in self.channels
+
+    def __iter__(self):
+        return (chan.name for chan in list(self.channels.values()))
+
+    def __len__(self):
+        return len(self.channels)
+
+    def _key(self, nick):
+        key = sys.intern(fold(nick))
+        if self.names.get(key) != nick:
+            self.names[key] = key if nick == key else sys.intern(nick)
+        return key
+
+    def _forget(self, key):
+        for chan in self.channels.values():
+            if key in chan._keys:
+                return
+        self.names.pop(key, None)
+
+    def _drop(self, chan, key):
+        chan._keys.discard(key)
+        for members in chan._modes.values():
+            members.discard(key)
+
+    def add_channel(self, channel):
+        chan = Channel(self, channel)
+        old = self.channels.get(fold(channel))
+        self.channels[fold(channel)] = chan
+        if old is not None:
+            for key in old._keys:
+                self._forget(key)
+        return chan
+
+    def remove_channel(self, channel):
+        chan = self.channels.pop(fold(channel), None)
+        if chan is not None:
+            for key in chan._keys:
+                self._forget(key)
+
+    def join(self, channel, nick):
+        chan = self.channels.get(fold(channel))
+        if chan is not None:
+            chan._keys.add(self._key(nick))
+
+    def part(self, channel, nick):
+        chan = self.channels.get(fold(channel))
+        if chan is not None:
+            key = fold(nick)
+            self._drop(chan, key)
+            self._forget(key)
+
+    def quit(self, nick):
+        key = fold(nick)
+        for chan in self.channels.values():
+            self._drop(chan, key)
+        self.names.pop(key, None)
+
+    def rename(self, before, after):
+        old, new = fold(before), self._key(after)
+        if old == new:
+            return
+        for chan in self.channels.values():
+            if old in chan._keys:
+                chan._keys.discard(old)
+                chan._keys.add(new)
+                for members in chan._modes.values():
+                    if old in members:
+                        members.discard(old)
+                        members.add(new)
+        self.names.pop(old, None)
+
+    def add_names(self, channel, nicks, prefixes=None):
+        # one 353 line, nicks may start with a status prefix like @ or +
+        chan = self.channels.get(fold(channel))
+        if chan is None:
+            return
+        keys = chan._keys
+        for nick in nicks:
+            if prefixes and nick[0] in prefixes:
+                mode = prefixes[nick[0]]
+                nick = nick.lstrip(''.join(prefixes))
+                chan._modes.setdefault(mode, set()).add(self._key(nick))
+            keys.add(self._key(nick))
+
+    def set_modes(self, channel, modes, prefixes=None):
+        # only nick modes (+o, +v, ...) are tracked
+        chan = self.channels.get(fold(channel))
+        if chan is None:
+            return
+        tracked = set(prefixes.values()) if prefixes else {'o', 'v'}
+        for sign, mode, nick in irc.modes.parse_channel_modes(modes):
+            if mode not in tracked or not nick:
+                continue
+            if sign == '+':
+                chan._modes.setdefault(mode, set()).add(self._key(nick))
+            else:
+                chan._modes.get(mode, set()).discard(fold(nick))
+
+    def clear(self):
+        self.channels.clear()
+        self.names.clear()
@@ -0,0 +1,322 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import multiprocessing
+import queue
+import threading
+
+from . import log
+from . import plugin
+from .acl import MaskSet
+from .log import logger
+from .twitch import Tags
+
+
+class _PipeReader:
+    # sits in the reactor's connection list so its select() also wakes up
+    # for replies from the shards
+    def __init__(self, conn, callback):
+        self.socket = conn
+        self.callback = callback
+
+    def process_data(self):
+        self.callback(self.socket)
+
+    def disconnect(self, message=''):
+        pass
+
+
+class _Shard:
+    # the plugin side, running in its own process
+    def __init__(self, conn, options):
+        self.conn = conn
+        self.options = options
+        self.message_class = options['message_class']
+        self.ops = MaskSet(options['ops'])
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def send(self, acked, replies):
+        with self.lock:
+            self.conn.send((acked, replies))
+
+    def load(self, incremental=False):
+        o = self.options
+        plugin.load_plugins(
+            o['plugin_dir'],
+            use_prefix=o['use_prefix'],
+            cmd_prefix=o['cmd_prefix'],
+            incremental=incremental,
+            lazy=o['lazy']
+        )
+
+    def run(self):
+        # without a plugin directory the plugins registered before the
+        # fork are used as they are
+        if self.options['load']:
+            self.load()
+        while True:
+            try:
+                batch = self.conn.recv()
+            except (EOFError, OSError):
+                return
+            replies = []
+            events = 0
+            for item in batch:
+                kind = item[0]
+                if kind == 'event':
+                    events += 1
+                    self.handle(replies, *item[1:])
+                elif kind == 'reload':
+                    self.load(incremental=item[1])
+                elif kind == 'enable':
+                    p = plugin.plugins.get(item[1])
+                    if p and item[2]:
+                        p.enable()
+                    elif p:
+                        p.disable()
+                elif kind == 'ops':
+                    self.ops = MaskSet(item[1])
+                elif kind == 'stop':
+                    return
+            self.send(events, replies)
+
+    def handle(self, replies, name, cmd, chan, text, nick, user, arg, msg_type, tags, timestamp):
+        fields = dict(
+            bot=None,
+            channel=chan,
+            cmd=name or cmd,
+            arg=arg,
+            text=text,
+            nick_list=(nick,) if chan == nick else (),
+            nick=nick,
+            user=user,
+            botnick=self.options['botnick'],
+            ops=self.ops,
+            logger=logger,
+            msg_type=msg_type,
+            timestamp=timestamp,
+            tags=Tags(tags) if tags is not None else None
+        )
+        message = self.message(fields, lambda kind: lambda target, text: replies.append((kind, target, text)))
+        if name:
+            command = plugin.cmds.get(name)
+            if command and command.enabled:
+                self.call(replies, command, message, fields, chan)
+            return
+        for lstnr in plugin.match_listeners(text, chan, msg_type):
+            if lstnr.enabled:
+                self.call(replies, lstnr, message, fields, chan)
+
+    def message(self, fields, sender):
+        return self.message_class(privmsg=sender('privmsg'), action=sender('action'), notice=sender('notice'), **fields)
+
+    def sender(self, kind):
+        return lambda target, text: self.send(0, [(kind, target, text)])
+
+    def call(self, replies, p, message, fields, chan):
+        p = p.resolve()
+        if not p:
+            return
+        key = None
+        if p.cache is not None:
+            key = p.cache.key(message)
+            output = p.cache.get(key)
+            if output:
+                replies.append(('output', chan, output))
+                return
+        if p.executor:
+            # blocking plugins get threads in here, the shard is already
+            # a process of its own
+            if not self.pool:
+                self.pool = ThreadPoolExecutor(max_workers=self.options['threads'], thread_name_prefix='pinhook-shard')
+            # the batch's replies are sent before the call is done, so what
+            # it sends on the way goes out on its own
+            future = self.pool.submit(p.run, self.message(fields, self.sender))
+            future.add_done_callback(lambda f: self.finish(f, p, chan, key))
+            return
+        try:
+            output = p.run(message)
+        except Exception:
+            logger.exception('issue with plugin %s', p)
+            return
+        if output:
+            if p.cache is not None:
+                p.cache.put(key, output)
+            replies.append(('output', chan, output))
+
+    def finish(self, future, p, chan, key):
+        if future.exception():
+            logger.error('issue with plugin %s', p, exc_info=future.exception())
+            return
+        output = future.result()
+        if output:
+            if p.cache is not None:
+                p.cache.put(key, output)
+            self.send(0, [('output', chan, output)])
+
+
+def _run_shard(conn, options):
+    # records put on the parent's log queue would never be written
+    log.stop_queue()
+    try:
+        _Shard(conn, options).run()
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardPool:
+    # the connection side of a sharded bot. Events are batched per reactor
+    # turn and sent to the shard that owns their channel (or command), the
+    # replies come back through the reactor. Sending happens on a thread per
+    # shard, so a busy shard never blocks the reactor while its replies
+    # wait to be read
+    def __init__(self, bot, shards, by='channel', queue_size=1000, load=True):
+        if by not in ('channel', 'command'):
+            raise ValueError("shard_by must be 'channel' or 'command'")
+        self.bot = bot
+        self.by = by
+        self.queue_size = queue_size
+        self.scheduler = bot.reactor.scheduler
+        self.buffers = [[] for _ in range(shards)]
+        self.in_flight = [0] * shards
+        self.conns = []
+        self.processes = []
+        self.outboxes = []
+        self.senders = []
+        self.dropped = 0
+        self._scheduled = False
+        options = {
+            'plugin_dir': bot.plugin_dir,
+            'use_prefix': bot.use_prefix_for_plugins,
+            'cmd_prefix': bot.cmd_prefix,
+            'lazy': bot.lazy_plugins,
+            'load': load,
+            'botnick': bot.bot_nick,
+            'ops': list(bot.ops),
+            'threads': bot.worker_threads,
+            'message_class': bot.Message,
+        }
+        for i in range(shards):
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_shard, args=(child, options), name='pinhook-shard-{}'.format(i), daemon=True)
+            process.start()
+            child.close()
+            outbox = queue.SimpleQueue()
+            sender = threading.Thread(target=self._send, args=(conn, outbox), name='pinhook-shard-send-{}'.format(i), daemon=True)
+            sender.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+            self.outboxes.append(outbox)
+            self.senders.append(sender)
+            self._watch(conn)
+        logger.info('started %s plugin shards, sharded by %s', shards, by)
+
+    def _watch(self, conn):
+        reactor = self.bot.reactor
+        reader = _PipeReader(conn, self.read)
+        if hasattr(reactor, 'loop'):
+            reactor.loop.add_reader(conn.fileno(), reader.process_data)
+        else:
+            with reactor.mutex:
+                reactor.connections.append(reader)
+
+    def _unwatch(self, conn):
+        reactor = self.bot.reactor
+        if hasattr(reactor, 'loop'):
+            reactor.loop.remove_reader(conn.fileno())
+        else:
+            with reactor.mutex:
+                reactor.connections[:] = [c for c in reactor.connections if getattr(c, 'socket', None) is not conn]
+
+    def shard_for(self, name, chan, nick):
+        if self.by == 'command':
+            # listeners only see the message, spread them by who sent it
+            key = name or nick
+        else:
+            key = chan
+        # crc32 puts '#chan0' to '#chan3' all on the same shard of two
+        digest = hashlib.blake2b(key.lower().encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') % len(self.conns)
+
+    def submit(self, name, cmd, chan, text, nick, user, arg, msg_type, tags, timestamp):
+        i = self.shard_for(name, chan, nick)
+        if self.conns[i].closed:
+            return False
+        if self.in_flight[i] >= self.queue_size:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning('shard %s is behind, %s events dropped so far', i, self.dropped)
+            return False
+        self.in_flight[i] += 1
+        self.buffers[i].append(('event', name, cmd, chan, text, nick, user, arg, msg_type, tags, timestamp))
+        self._schedule()
+        return True
+
+    def broadcast(self, *item):
+        for buffer in self.buffers:
+            buffer.append(item)
+        self._schedule()
+
+    def _schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self.scheduler.execute_after(0, self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        for i, buffer in enumerate(self.buffers):
+            if buffer:
+                self.outboxes[i].put(buffer)
+                self.buffers[i] = []
+
+    def _send(self, conn, outbox):
+        while True:
+            batch = outbox.get()
+            if batch is None:
+                return
+            try:
+                conn.send(batch)
+            except OSError:
+                logger.error('could not reach plugin shard')
+                return
+
+    def read(self, conn):
+        i = self.conns.index(conn)
+        try:
+            with self.bot.batch_writes():
+                while conn.poll():
+                    acked, replies = conn.recv()
+                    self.in_flight[i] -= acked
+                    for reply in replies:
+                        self.deliver(*reply)
+        except (EOFError, OSError):
+            logger.error('plugin shard %s exited', i)
+            self._unwatch(conn)
+            conn.close()
+
+    def deliver(self, kind, target, payload):
+        c = self.bot.connection
+        try:
+            if kind == 'output':
+                self.bot.process_output(c, target, payload)
+            elif kind == 'privmsg':
+                self.bot.send_queue.put(c.privmsg, target, payload)
+            elif kind == 'action':
+                self.bot.send_queue.put(c.action, target, payload)
+            elif kind == 'notice':
+                self.bot.send_queue.put(c.notice, target, payload)
+        except Exception:
+            logger.exception('issue sending shard output')
+
+    def stop(self):
+        self.broadcast('stop')
+        self.flush()
+        for outbox, sender in zip(self.outboxes, self.senders):
+            outbox.put(None)
+            sender.join(1)
+        for conn in self.conns:
+            if not conn.closed:
+                self._unwatch(conn)
+                conn.close()
+        for process in self.processes:
+            process.join(1)
@@ -0,0 +1,217 @@
+from collections.abc import MutableMapping
+import atexit
+import json
+import os
+import sqlite3
+import threading
+
+from .log import logger
+
+# open stores by absolute path, plugins share the first one opened
+stores = {}
+default = None
+# cached for keys known not to be stored
+_absent = object()
+
+
+class Namespace(MutableMapping):
+    # one plugin's keys. Values are anything json can encode, reads come from
+    # memory after the first time and writes are saved in the background.
+    # Changing a stored list or dict in place isn't noticed, assign it again
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.cache = {}
+        self.complete = False
+
+    def __repr__(self):
+        return '<Namespace {} of {}>'.format(self.name, self.store.path)
+
+    def __getitem__(self, key):
+        value = self.cache.get(key, _absent)
+        if value is _absent and not self.complete and key not in self.cache:
+            value = self.store._load(self.name, key)
+            self.cache[key] = value
+        if value is _absent:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise TypeError('store keys must be strings, not {}'.format(type(key).__name__))
+        data = json.dumps(value)
+        self.cache[key] = value
+        self.store._write(self.name, key, data)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.cache[key] = _absent
+        self.store._write(self.name, key, None)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def _load_all(self):
+        if not self.complete:
+            for key, value in self.store._load_all(self.name):
+                # anything in the cache is newer than what's on disk
+                self.cache.setdefault(key, value)
+            self.complete = True
+
+    def __iter__(self):
+        self._load_all()
+        return iter([k for k, v in list(self.cache.items()) if v is not _absent])
+
+    def __len__(self):
+        self._load_all()
+        return sum(1 for v in list(self.cache.values()) if v is not _absent)
+
+    def flush(self):
+        self.store.flush()
+
+
+class Store:
+    # key-value state for plugins in one SQLite file. Writes are collected
+    # and committed together every `flush_interval` seconds by a background
+    # thread, so handling a message never waits on the disk
+    def __init__(self, path, flush_interval=5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.namespaces = {}
+        self.writes = 0
+        self.flushes = 0
+        self._reset()
+
+    def _reset(self):
+        self.pending = {}
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._closed = False
+
+    def __repr__(self):
+        return '<Store {}>'.format(self.path)
+
+    def namespace(self, name):
+        ns = self.namespaces.get(name)
+        if ns is None:
+            ns = self.namespaces.setdefault(name, Namespace(self, name))
+        return ns
+
+    __getitem__ = namespace
+
+    @property
+    def db(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS kv ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, key)) WITHOUT ROWID'
+            )
+            self._db = db
+        return self._db
+
+    def _load(self, namespace, key):
+        with self._db_lock:
+            row = self.db.execute('SELECT value FROM kv WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        return json.loads(row[0]) if row else _absent
+
+    def _load_all(self, namespace):
+        with self._db_lock:
+            rows = self.db.execute('SELECT key, value FROM kv WHERE namespace = ?', (namespace,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def _write(self, namespace, key, data):
+        with self._pending_lock:
+            self.pending[(namespace, key)] = data
+            self.writes += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pinhook-store', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._pending_lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        upserts = [(ns, key, data) for (ns, key), data in pending.items() if data is not None]
+        deletes = [(ns, key) for (ns, key), data in pending.items() if data is None]
+        with self._db_lock:
+            db = self.db
+            try:
+                db.execute('BEGIN')
+                db.executemany('INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)', upserts)
+                db.executemany('DELETE FROM kv WHERE namespace = ? AND key = ?', deletes)
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                logger.exception('could not save %s store changes to %s', len(pending), self.path)
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                # keep them for the next try, unless they were changed since
+                with self._pending_lock:
+                    for k, v in pending.items():
+                        self.pending.setdefault(k, v)
+                return
+        self.flushes += 1
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def open_store(path='pinhook.db', flush_interval=5):
+    global default
+    key = os.path.abspath(path)
+    store = stores.get(key)
+    if store is None:
+        store = stores[key] = Store(path, flush_interval)
+    if default is None:
+        default = store
+    return store
+
+
+def default_store():
+    return default or open_store()
+
+
+def _close_all():
+    for store in list(stores.values()):
+        try:
+            store.close()
+        except Exception:
+            logger.exception('could not close store %s', store.path)
+
+
+def _after_fork():
+    # a forked shard gets its own connection and flush thread, changes
+    # that were still waiting belong to the parent
+    for store in stores.values():
+        store._reset()
+
+
+atexit.register(_close_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,118 @@
+import os
+
+from . import plugin
+from .bot import Bot, TwitchBot
+from .log import logger
+from .store import open_store
+from .watch import PluginWatcher
+from .worker import WorkerPool
+
+import irc.client
+
+
+class SharedReactor(irc.client.Reactor):
+    # every bot registers its handlers globally on the reactor, so only pass
+    # each event to the handlers owned by the connection it arrived on
+    def _handle_event(self, connection, event):
+        with self.mutex:
+            matching_handlers = sorted(
+                self.handlers.get('all_events', []) + self.handlers.get(event.type, [])
+            )
+            for handler in matching_handlers:
+                owner = getattr(handler.callback, '__self__', None)
+                if not isinstance(owner, irc.client.ServerConnection):
+                    owner = getattr(owner, 'connection', connection)
+                if owner is not connection:
+                    continue
+                result = handler.callback(connection, event)
+                if result == 'NO MORE':
+                    return
+
+
+class Supervisor:
+    bot_types = {
+        'irc': Bot,
+        'twitch': TwitchBot,
+    }
+
+    def __init__(self, bots, **kwargs):
+        if 'acl_file' in kwargs:
+            raise ValueError('acl_file has to be set for each bot, bots sharing one would share their ops and bans')
+        self.plugin_dir = kwargs.get('plugin_dir', 'plugins')
+        self.use_prefix_for_plugins = kwargs.get('use_prefix_for_plugins', False)
+        self.cmd_prefix = kwargs.get('cmd_prefix', '!')
+        self.log_file = kwargs.get('log_file', 'pinhook.log')
+        self.lazy_plugins = kwargs.get('lazy_plugins', False)
+        self.parallel_imports = kwargs.get('parallel_imports', 0)
+        self.reactor = SharedReactor()
+        self.workers = WorkerPool(
+            self.reactor.scheduler,
+            threads=kwargs.get('worker_threads', 4),
+            processes=kwargs.get('worker_processes', None),
+            queue_size=kwargs.get('worker_queue_size', 100),
+            timeout=kwargs.get('worker_timeout', 30)
+        )
+        # everything except the plugin settings is a default for each bot
+        self.defaults = {k: v for k, v in kwargs.items() if not k.startswith('worker_')}
+        self.defaults.pop('plugin_dir', None)
+        self.defaults.pop('use_prefix_for_plugins', None)
+        self.defaults.pop('watch_plugins', None)
+        self.defaults.pop('watch_interval', None)
+        self.bots = []
+        # plugins calling plugin.store() at import get the store of the
+        # first bot, as they do with one bot, not ./pinhook.db
+        first = dict(self.defaults, **bots[0]) if bots else self.defaults
+        open_store(first.get('store_file', 'pinhook.db'), first.get('store_flush_interval', 5))
+        plugin.load_plugins(
+            self.plugin_dir,
+            use_prefix=self.use_prefix_for_plugins,
+            cmd_prefix=self.cmd_prefix,
+            lazy=self.lazy_plugins,
+            parallel=self.parallel_imports
+        )
+        for conf in bots:
+            self.add_bot(conf)
+        self.watcher = None
+        if kwargs.get('watch_plugins', False):
+            self.watcher = PluginWatcher(self.reactor.scheduler, self.plugin_dir, self.reload_plugins, interval=kwargs.get('watch_interval', 2))
+
+    def reload_plugins(self):
+        changed = plugin.load_plugins(
+            self.plugin_dir,
+            use_prefix=self.use_prefix_for_plugins,
+            cmd_prefix=self.cmd_prefix,
+            incremental=True,
+            lazy=self.lazy_plugins,
+            parallel=self.parallel_imports
+        )
+        self.workers.reset_processes()
+        for bot in self.bots:
+            bot.jobs.sync()
+        return changed
+
+    def add_bot(self, conf):
+        conf = dict(self.defaults, **conf)
+        bot_type = conf.pop('type', 'irc')
+        if conf.get('plugin_dir', self.plugin_dir) != self.plugin_dir:
+            logger.warning('plugins are shared between bots, ignoring plugin_dir %s', conf['plugin_dir'])
+        conf.update(
+            reactor=self.reactor,
+            workers=self.workers,
+            load_plugins=False,
+            plugin_dir=self.plugin_dir,
+            use_prefix_for_plugins=self.use_prefix_for_plugins,
+            log_file=self.log_file
+        )
+        # each bot replays and compacts its acl file as if it were its own
+        acl_file = conf.get('acl_file')
+        if acl_file and any(b.acl_file and os.path.abspath(b.acl_file) == os.path.abspath(acl_file) for b in self.bots):
+            raise ValueError('acl_file {} is already used by another bot'.format(acl_file))
+        bot = self.bot_types[bot_type](**conf)
+        self.bots.append(bot)
+        return bot
+
+    def start(self):
+        for bot in self.bots:
+            logger.info('connecting %s', bot.bot_nick)
+            bot._connect()
+        self.reactor.process_forever()
@@ -0,0 +1,275 @@
+import base64
+import contextlib
+import hashlib
+import os
+import socket
+import ssl
+
+default_ports = {'tcp': 6667, 'tls': 6697, 'ws': 80, 'wss': 443}
+# most buffers one sendmsg takes
+_IOV_MAX = 1024
+# the server proves it speaks websocket by hashing our key with this
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_CONTINUATION, _TEXT, _BINARY, _CLOSE, _PING, _PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def ssl_context(verify=True, ca_file=None):
+    context = ssl.create_default_context(cafile=ca_file)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class TCP:
+    # what irc.client sees as the connection's socket. Reads go through one
+    # reusable buffer, and lines written inside batch() leave together in
+    # a single sendmsg instead of a send each
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.buffer = bytearray(bufsize)
+        self.view = memoryview(self.buffer)
+        self.pending = []
+        self.holding = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _recv(self):
+        n = self.sock.recv_into(self.buffer)
+        return bytes(self.view[:n])
+
+    def read(self, size=None):
+        # irc.client asks for 16KiB, a burst is taken in one go instead
+        return self._recv()
+
+    def write(self, data):
+        if self.holding:
+            self.pending.append(data)
+        else:
+            self._send([data])
+        return len(data)
+
+    # irc.client looks these up too, even though it uses read and write
+    recv = read
+    send = write
+
+    def _send(self, buffers):
+        sent = self.sock.sendmsg(buffers)
+        if sent < sum(len(b) for b in buffers):
+            self.sock.sendall(b''.join(buffers)[sent:])
+
+    @contextlib.contextmanager
+    def batch(self):
+        self.holding += 1
+        try:
+            yield
+        finally:
+            self.holding -= 1
+            if not self.holding and self.pending:
+                self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        try:
+            for i in range(0, len(pending), _IOV_MAX):
+                self._send(pending[i:i + _IOV_MAX])
+        except OSError:
+            # send_raw isn't around to notice, the next read will hang up
+            with contextlib.suppress(OSError):
+                self.sock.shutdown(socket.SHUT_RDWR)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.pending = []
+        self.sock.close()
+
+
+class TLS(TCP):
+    def read(self, size=None):
+        # data the ssl module already decrypted doesn't make the socket
+        # readable again, so everything pending is taken now
+        data = self._recv()
+        while data and self.sock.pending():
+            data += self._recv()
+        return data
+
+    def _send(self, buffers):
+        # no sendmsg for ssl sockets, one sendall makes as few records
+        self.sock.sendall(b''.join(buffers))
+
+
+def _mask(data, key):
+    n = len(data)
+    mask = int.from_bytes((key * (n // 4 + 1))[:n], 'little')
+    return (int.from_bytes(data, 'little') ^ mask).to_bytes(n, 'little')
+
+
+def ws_frame(opcode, payload, mask=True):
+    # clients have to mask what they send, servers must not
+    n = len(payload)
+    bit = 0x80 if mask else 0
+    if n < 126:
+        head = bytes((0x80 | opcode, bit | n))
+    elif n < 65536:
+        head = bytes((0x80 | opcode, bit | 126)) + n.to_bytes(2, 'big')
+    else:
+        head = bytes((0x80 | opcode, bit | 127)) + n.to_bytes(8, 'big')
+    if mask:
+        key = os.urandom(4)
+        return head + key + _mask(payload, key)
+    return head + payload
+
+
+def ws_parse(data):
+    # the complete frames at the start of `data` as (fin, opcode, payload),
+    # and the number of bytes they took
+    frames = []
+    pos = 0
+    end = len(data)
+    while end - pos >= 2:
+        first, second = data[pos], data[pos + 1]
+        n = second & 0x7f
+        head = 2
+        if n == 126:
+            head = 4
+        elif n == 127:
+            head = 10
+        if second & 0x80:
+            head += 4
+        if end - pos < head:
+            break
+        if n >= 126:
+            n = int.from_bytes(data[pos + 2:pos + (4 if n == 126 else 10)], 'big')
+        if end - pos < head + n:
+            break
+        payload = bytes(data[pos + head:pos + head + n])
+        if second & 0x80:
+            payload = _mask(payload, bytes(data[pos + head - 4:pos + head]))
+        frames.append((bool(first & 0x80), first & 0x0f, payload))
+        pos += head + n
+    return frames, pos
+
+
+def ws_accept(key):
+    return base64.b64encode(hashlib.sha1(key + _WS_GUID).digest())
+
+
+class WebSocket:
+    # IRC over a websocket on top of a TCP or TLS stream, the way Twitch and
+    # IRCv3 servers offer it: each line is sent as a text frame of its own,
+    # and frames received may hold one or more lines
+    def __init__(self, stream, host, port, path='/'):
+        self.stream = stream
+        self.incoming = bytearray()
+        self.message = bytearray()
+        self.closing = False
+        self._handshake(host, port, path)
+
+    def _handshake(self, host, port, path):
+        key = base64.b64encode(os.urandom(16))
+        if port not in (80, 443):
+            host = '{}:{}'.format(host, port)
+        self.stream.write(
+            'GET {} HTTP/1.1\r\nHost: {}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n'.format(path, host, key.decode('ascii')).encode('ascii')
+        )
+        while b'\r\n\r\n' not in self.incoming:
+            data = self.stream.read()
+            if not data or len(self.incoming) > 16384:
+                raise OSError('websocket handshake failed: no response')
+            self.incoming += data
+        head, _, rest = bytes(self.incoming).partition(b'\r\n\r\n')
+        # frames sent right after the response belong to the first read
+        self.incoming = bytearray(rest)
+        status, *lines = head.decode('latin-1').split('\r\n')
+        headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines)}
+        if status.split()[1:2] != ['101']:
+            raise OSError('websocket handshake failed: {}'.format(status))
+        if headers.get('sec-websocket-accept', '').encode('ascii') != ws_accept(key):
+            raise OSError('websocket handshake failed: bad Sec-WebSocket-Accept')
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def read(self, size=None):
+        if self.closing:
+            return b''
+        data = self.stream.read()
+        if not data:
+            return data
+        self.incoming += data
+        frames, used = ws_parse(self.incoming)
+        del self.incoming[:used]
+        lines = []
+        for fin, opcode, payload in frames:
+            if opcode == _CLOSE:
+                self.closing = True
+                break
+            elif opcode == _PING:
+                self.stream.write(ws_frame(_PONG, payload))
+            elif opcode in (_TEXT, _BINARY, _CONTINUATION):
+                self.message += payload
+                if fin:
+                    if not self.message.endswith(b'\n'):
+                        self.message += b'\r\n'
+                    lines.append(bytes(self.message))
+                    self.message = bytearray()
+        if not lines and self.closing:
+            return b''
+        # irc.client takes an empty read for a hang up, an empty line is
+        # skipped instead when only part of a frame or a ping came in
+        return b''.join(lines) or b'\r\n'
+
+    def write(self, data):
+        self.stream.write(ws_frame(_TEXT, data.rstrip(b'\r\n')))
+        return len(data)
+
+    recv = read
+    send = write
+
+    def batch(self):
+        return self.stream.batch()
+
+    def shutdown(self, how):
+        with contextlib.suppress(OSError):
+            self.stream.write(ws_frame(_CLOSE, (1000).to_bytes(2, 'big')))
+        self.stream.shutdown(how)
+
+    def close(self):
+        self.stream.close()
+
+
+class Factory:
+    # connect_factory for irc.client, making connections over 'tcp', 'tls',
+    # 'ws' or 'wss'
+    def __init__(self, transport='tcp', context=None, path='/', bind_address=None, timeout=30):
+        if transport not in default_ports:
+            raise ValueError("transport must be one of 'tcp', 'tls', 'ws' or 'wss'")
+        if context is None and transport in ('tls', 'wss'):
+            context = ssl_context()
+        self.transport = transport
+        self.context = context
+        self.path = path
+        self.bind_address = bind_address
+        self.timeout = timeout
+
+    def __call__(self, address):
+        host, port = address
+        sock = socket.create_connection(address, self.timeout, self.bind_address)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.context is not None:
+                sock = self.context.wrap_socket(sock, server_hostname=host)
+                stream = TLS(sock)
+            else:
+                stream = TCP(sock)
+            if self.transport in ('ws', 'wss'):
+                stream = WebSocket(stream, host, port, self.path)
+            sock.settimeout(None)
+        except BaseException:
+            sock.close()
+            raise
+        return stream
@@ -0,0 +1,82 @@
+def _badges(value):
+    # 'moderator/1,subscriber/12' -> {'moderator': '1', 'subscriber': '12'}
+    if not value:
+        return {}
+    badges = {}
+    for badge in value.split(','):
+        name, _, version = badge.partition('/')
+        badges[name] = version
+    return badges
+
+
+class Tags:
+    # IRCv3 tags of a twitch message, parsed once per event. Emotes and bits
+    # are only decoded when they are used
+    __slots__ = ('raw', 'badges', 'badge_info', 'display_name', 'user_id', 'room_id', 'id',
+                 'color', 'mod', 'broadcaster', 'subscriber', 'vip', 'sent_ts', '_emotes', '_bits')
+
+    def __init__(self, raw):
+        self.raw = raw
+        get = raw.get
+        self.badges = _badges(get('badges'))
+        self.badge_info = _badges(get('badge-info'))
+        self.display_name = get('display-name')
+        self.user_id = get('user-id')
+        self.room_id = get('room-id')
+        self.id = get('id')
+        self.color = get('color')
+        self.broadcaster = 'broadcaster' in self.badges
+        self.mod = get('mod') == '1' or 'moderator' in self.badges or self.broadcaster
+        self.subscriber = get('subscriber') == '1' or 'subscriber' in self.badges
+        self.vip = 'vip' in self.badges or get('vip') == '1'
+        sent = get('tmi-sent-ts')
+        self.sent_ts = int(sent) / 1000 if sent and sent.isdigit() else None
+        self._emotes = None
+        self._bits = None
+
+    @classmethod
+    def from_event(cls, tags):
+        # irc gives tags as a list of {'key': ..., 'value': ...}
+        if not tags:
+            return None
+        return cls({t['key']: t['value'] for t in tags})
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+    def __repr__(self):
+        return 'Tags({!r})'.format(self.raw)
+
+    @property
+    def emotes(self):
+        # {'25': [(0, 4), (12, 16)]}, positions are inclusive and count
+        # characters of the message text
+        if self._emotes is None:
+            emotes = {}
+            value = self.raw.get('emotes')
+            if value:
+                for emote in value.split('/'):
+                    emote_id, _, ranges = emote.partition(':')
+                    positions = []
+                    for r in ranges.split(','):
+                        start, _, end = r.partition('-')
+                        if start.isdigit() and end.isdigit():
+                            positions.append((int(start), int(end)))
+                    emotes[emote_id] = positions
+            self._emotes = emotes
+        return self._emotes
+
+    def emote_names(self, text):
+        # {'Kappa': '25'} for the emotes used in text
+        return {text[positions[0][0]:positions[0][1] + 1]: emote_id
+                for emote_id, positions in self.emotes.items() if positions}
+
+    @property
+    def bits(self):
+        if self._bits is None:
+            value = self.raw.get('bits')
+            self._bits = int(value) if value and value.isdigit() else 0
+        return self._bits
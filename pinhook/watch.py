@@ -0,0 +1,53 @@
+import os
+
+from .log import logger
+
+
+class PluginWatcher:
+    def __init__(self, scheduler, plugin_dir, callback, interval=2):
+        self.plugin_dir = plugin_dir
+        self.callback = callback
+        self.inotify = None
+        self.snapshot = None
+        self.stopped = False
+        try:
+            import inotify_simple
+        except ImportError:
+            logger.info('inotify_simple not installed, polling %s for changes', plugin_dir)
+            self.snapshot = self._scan()
+        else:
+            flags = inotify_simple.flags
+            self.inotify = inotify_simple.INotify()
+            self.inotify.add_watch(
+                plugin_dir,
+                flags.CLOSE_WRITE | flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+            )
+        scheduler.execute_every(interval, self.check)
+
+    def _scan(self):
+        try:
+            return {e.name: e.stat().st_mtime_ns for e in os.scandir(self.plugin_dir) if e.name.endswith('.py')}
+        except OSError:
+            return {}
+
+    def check(self):
+        if self.stopped:
+            return
+        if self.inotify:
+            changed = any(e.name.endswith('.py') for e in self.inotify.read(timeout=0))
+        else:
+            snapshot = self._scan()
+            changed = snapshot != self.snapshot
+            self.snapshot = snapshot
+        if changed:
+            logger.info('change detected in %s, reloading plugins', self.plugin_dir)
+            try:
+                self.callback()
+            except Exception:
+                logger.exception('issue reloading plugins')
+
+    def stop(self):
+        self.stopped = True
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,143 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import time
+
+from . import metrics
+from .log import logger
+
+
+class _ProcessMessage:
+    # picklable stand-in for Bot.Message, the bot and irc callables can not
+    # be sent to another process
+    attrs = ('channel', 'nick', 'user', 'nick_list', 'botnick', 'ops', 'logger',
+             'msg_type', 'datetime', 'timestamp', 'cmd', 'arg', 'text', 'tags')
+
+    def __init__(self, msg):
+        for attr in self.attrs:
+            if hasattr(msg, attr):
+                setattr(self, attr, getattr(msg, attr))
+        # the channel roster is a live view, send a copy of it
+        if hasattr(self, 'nick_list'):
+            self.nick_list = list(self.nick_list)
+
+
+def _run(func, msg):
+    return func(msg)
+
+
+def _run_timed(func, msg):
+    # times the call inside the worker so queueing and polling aren't counted
+    start = time.perf_counter()
+    try:
+        output = func(msg)
+    except Exception as exc:
+        return time.perf_counter() - start, exc, None
+    return time.perf_counter() - start, None, output
+
+
+class WorkerPool:
+    def __init__(self, scheduler, threads=4, processes=None, queue_size=100, timeout=30, poll_interval=.1):
+        self.scheduler = scheduler
+        self.threads = threads
+        self.processes = processes
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.pending = []
+        # calls that timed out but can't be stopped, they keep their worker
+        # and count toward queue_size until they return
+        self.abandoned = []
+        self._thread_pool = None
+        self._process_pool = None
+        self._scheduled = False
+
+    def executor(self, kind):
+        if kind == 'process':
+            if not self._process_pool:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.processes)
+            return self._process_pool
+        if not self._thread_pool:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='pinhook-worker')
+        return self._thread_pool
+
+    def submit(self, plugin, msg, callback):
+        if len(self.pending) + len(self.abandoned) >= self.queue_size:
+            logger.warning('worker queue full, dropping call to %s (%s timed out calls still running)', plugin, len(self.abandoned))
+            return False
+        timed = metrics.enabled
+        run = _run_timed if timed else _run
+        if plugin.executor == 'process':
+            future = self.executor('process').submit(run, plugin.run, _ProcessMessage(msg))
+        else:
+            future = self.executor('thread').submit(run, plugin.run, msg)
+        timeout = plugin.timeout or self.timeout
+        self.pending.append((future, time.monotonic() + timeout, plugin, callback, timed))
+        if not self._scheduled:
+            self._scheduled = True
+            self.scheduler.execute_after(self.poll_interval, self.poll)
+        return future
+
+    def run_in_executor(self, loop, plugin, msg):
+        # asyncio counterpart of submit(), sync plugins default to threads
+        if plugin.executor == 'process':
+            return loop.run_in_executor(self.executor('process'), _run, plugin.run, _ProcessMessage(msg))
+        return loop.run_in_executor(self.executor('thread'), plugin.run, msg)
+
+    def poll(self):
+        # runs on the reactor thread, so callbacks can safely send output
+        now = time.monotonic()
+        pending = []
+        for future, deadline, plugin, callback, timed in self.pending:
+            if future.done():
+                if future.cancelled():
+                    continue
+                exc = future.exception()
+                output = None
+                if not exc and timed:
+                    elapsed, exc, output = future.result()
+                    metrics.record(plugin.kind, str(plugin), elapsed, error=exc is not None)
+                elif not exc:
+                    output = future.result()
+                if exc:
+                    logger.error('issue with plugin %s', plugin, exc_info=exc)
+                    continue
+                if output:
+                    try:
+                        callback(output)
+                    except Exception:
+                        logger.exception('issue handling output of %s', plugin)
+            elif now > deadline:
+                if timed:
+                    metrics.record(plugin.kind, str(plugin), plugin.timeout or self.timeout, error=True)
+                # cancel() only stops calls that haven't started
+                if future.cancel():
+                    logger.warning('plugin %s timed out, discarding result', plugin)
+                else:
+                    logger.warning('plugin %s timed out, discarding result, its worker stays busy until it returns', plugin)
+                    self.abandoned.append((future, plugin, deadline))
+            else:
+                pending.append((future, deadline, plugin, callback, timed))
+        self.pending = pending
+        abandoned = []
+        for future, plugin, deadline in self.abandoned:
+            if future.done():
+                logger.warning('plugin %s returned %.1fs after timing out', plugin, now - deadline)
+            else:
+                abandoned.append((future, plugin, deadline))
+        self.abandoned = abandoned
+        if self.pending or self.abandoned:
+            self.scheduler.execute_after(self.poll_interval, self.poll)
+        else:
+            self._scheduled = False
+
+    def reset_processes(self):
+        # worker processes keep the plugin modules they were forked with
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
+
+    def shutdown(self):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool:
+                pool.shutdown(wait=False)
+        self._thread_pool = None
+        self._process_pool = None
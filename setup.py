@@ -29,7 +29,8 @@ REQUIRED = [
 
 EXTRAS = {
     'toml': ['toml'],
-    'yaml': ['pyyaml']
+    'yaml': ['pyyaml'],
+    'watch': ['inotify_simple'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -100,7 +101,9 @@ setup(
     packages=['pinhook'],
     entry_points={
         'console_scripts':
-            ['pinhook=pinhook.cli:cli']
+            ['pinhook=pinhook.cli:cli',
+             'pinhook-supervisor=pinhook.cli:supervise',
+             'pinhook-benchmark=pinhook.cli:benchmark']
     },
     install_requires=REQUIRED,
     extras_require=EXTRAS,